@@ -0,0 +1,189 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import posixpath
+import re
+import shutil
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image, features
+except ImportError:
+    Image = None
+
+
+# Build step for everything under static/: every file is copied to static/build/ under a name containing a hash of
+# its content, so it can be cached forever and a new version simply gets a new url. Text files are compressed ahead
+# of time and masthead images get smaller variants per breakpoint. manifest.json maps the original names to the
+# built ones and is what url_for('static') reads.
+BUILD_DIRECTORY = 'build'
+MANIFEST_NAME = 'manifest.json'
+SKIPPED_DIRECTORIES = {BUILD_DIRECTORY, 'scss'}
+COMPRESSED_EXTENSIONS = {'.css', '.js', '.map', '.svg', '.json', '.txt', '.eot', '.ttf'}
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+IMAGE_WIDTHS = [480, 960, 1440, 1920]
+# (extension, Pillow format, mime type), best first; formats the installed Pillow can't write are left out
+IMAGE_FORMATS = [('.avif', 'AVIF', 'image/avif'), ('.webp', 'WEBP', 'image/webp')]
+CSS_REFERENCE = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)|(sourceMappingURL=)(\S+)')
+
+
+def content_hash(data):
+    return hashlib.md5(data).hexdigest()[:12]
+
+
+def hashed_name(name, data, suffix=''):
+    stem, extension = posixpath.splitext(name)
+    return f"{stem}{suffix}.{content_hash(data)}{extension}"
+
+
+def write_file(build_root, name, data):
+    path = os.path.join(build_root, *name.split('/'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as built_file:
+        built_file.write(data)
+    if posixpath.splitext(name)[1] in COMPRESSED_EXTENSIONS:
+        compressed = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(compressed) < len(data):
+            with open(path + '.gz', 'wb') as built_file:
+                built_file.write(compressed)
+        if brotli:
+            compressed = brotli.compress(data, quality=11)
+            if len(compressed) < len(data):
+                with open(path + '.br', 'wb') as built_file:
+                    built_file.write(compressed)
+
+
+def rewrite_css(name, data, files):
+    # relative references (fonts, images, source maps) have to point at the hashed names as well
+    directory = posixpath.dirname(name)
+
+    def replace(match):
+        reference = match.group(2) or match.group(4)
+        path, separator, rest = partition_reference(reference)
+        target = posixpath.normpath(posixpath.join(directory, path))
+        if ':' in path or path.startswith('/') or target not in files:
+            return match.group(0)
+        replacement = posixpath.relpath(files[target], directory) + separator + rest
+        if match.group(3):
+            return match.group(3) + replacement
+        return f"url({match.group(1)}{replacement}{match.group(1)})"
+
+    return CSS_REFERENCE.sub(replace, data.decode('utf-8')).encode('utf-8')
+
+
+def partition_reference(reference):
+    match = re.search(r'[?#]', reference)
+    if not match:
+        return reference, '', ''
+    return reference[:match.start()], match.group(0), reference[match.end():]
+
+
+def image_formats():
+    if Image is None:
+        return []
+    return [image_format for image_format in IMAGE_FORMATS if features.check(image_format[1].lower())]
+
+
+def build_variants(build_root, name, source_path):
+    """Write resized copies of an image; returns [{'path', 'width', 'type'}] of what was written."""
+    if Image is None:
+        return []
+    variants = []
+    with Image.open(source_path) as image:
+        image.load()
+        original_format = image.format
+        mime_type = Image.MIME.get(original_format, 'image/jpeg')
+        formats = image_formats() + [(posixpath.splitext(name)[1], original_format, mime_type)]
+        widths = [width for width in IMAGE_WIDTHS if width < image.width] + [image.width]
+        for width in widths:
+            resized = image if width == image.width else \
+                image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+            for extension, pillow_format, variant_type in formats:
+                if width == image.width and pillow_format == original_format:
+                    continue
+                converted = resized if pillow_format == 'PNG' or resized.mode in ('RGB', 'L') \
+                    else resized.convert('RGB')
+                options = {'optimize': True} if pillow_format in ('JPEG', 'PNG') else {}
+                if pillow_format != 'PNG':
+                    options['quality'] = 80
+                output = io.BytesIO()
+                converted.save(output, pillow_format, **options)
+                output = output.getvalue()
+                stem = posixpath.splitext(name)[0]
+                variant_name = hashed_name(stem + extension, output, suffix=f'-{width}')
+                write_file(build_root, variant_name, output)
+                variants.append({'path': variant_name, 'width': width, 'type': variant_type})
+    variants.append({'path': None, 'width': widths[-1], 'type': mime_type})
+    return variants
+
+
+def build(static_folder):
+    build_root = os.path.join(static_folder, BUILD_DIRECTORY)
+    shutil.rmtree(build_root, ignore_errors=True)
+    sources = []
+    for directory, directories, names in os.walk(static_folder):
+        relative_directory = os.path.relpath(directory, static_folder)
+        if relative_directory == '.':
+            directories[:] = [name for name in directories if name not in SKIPPED_DIRECTORIES]
+        for name in names:
+            path = os.path.join(directory, name)
+            sources.append((posixpath.normpath(posixpath.join(relative_directory.replace(os.sep, '/'), name)), path))
+    # stylesheets last, they need the hashed names of what they reference
+    sources.sort(key=lambda source: (source[0].endswith('.css'), source[0]))
+    files = {}
+    variants = {}
+    for name, path in sources:
+        with open(path, 'rb') as source_file:
+            data = source_file.read()
+        if name.endswith('.css'):
+            data = rewrite_css(name, data, files)
+        files[name] = hashed_name(name, data)
+        write_file(build_root, files[name], data)
+        if posixpath.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+            built = build_variants(build_root, name, path)
+            if built:
+                built[-1]['path'] = files[name]
+                variants[name] = built
+    manifest = {'files': files, 'variants': variants}
+    with open(os.path.join(build_root, MANIFEST_NAME), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+    return manifest
+
+
+def empty_manifest():
+    return {'files': {}, 'variants': {}}
+
+
+def load_manifest(static_folder):
+    path = os.path.join(static_folder, BUILD_DIRECTORY, MANIFEST_NAME)
+    try:
+        with open(path) as manifest_file:
+            manifest = json.load(manifest_file)
+        built_at = os.path.getmtime(path)
+    except (OSError, ValueError):
+        # not built (yet): url_for keeps pointing at the plain files
+        return empty_manifest()
+    # a source changed since the last build: its built copy is out of date, so that file is served as it is
+    for name in list(manifest['files']):
+        try:
+            stale = os.path.getmtime(os.path.join(static_folder, *name.split('/'))) > built_at
+        except OSError:
+            stale = True
+        if stale:
+            del manifest['files'][name]
+            manifest['variants'].pop(name, None)
+    return manifest
+
+
+if __name__ == "__main__":
+    static = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    result = build(static)
+    print(f"{len(result['files'])} files and {len(result['variants'])} images built into "
+          f"{os.path.join(static, BUILD_DIRECTORY)}")
@@ -0,0 +1,101 @@
+"""Fill a fresh database with a reproducible, synthetic dataset of the given size.
+
+    python benchmarks/generate_data.py benchmark.db --users 10000 --courses 1000 --words 1000000
+
+Every user's password is "benchmark". User 1 is the admin, users 2 .. courses + 1 manage one course each and the
+others study a random course.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PASSWORD = 'benchmark'
+SYLLABLES = ['ba', 'be', 'bi', 'bu', 'da', 'de', 'di', 'fa', 'fe', 'ga', 'ge', 'ha', 'he', 'ka', 'ke', 'la', 'le',
+             'li', 'ma', 'me', 'na', 'ne', 'ra', 're', 'sa', 'sch', 'st', 'ta', 'te', 'ung', 'ä', 'ö', 'ü', 'ei',
+             'au', 'ß', 'ch', 'en', 'er', 'el']
+MEANING_SYLLABLES = ['ta', 'ble', 'win', 'dow', 'hou', 'se', 'tree', 'car', 'pen', 'cil', 'bo', 'ok', 'ro', 'om',
+                     'li', 'ght', 'wa', 'ter', 'sun', 'day']
+GENDERS = ['der', 'die', 'das', '']
+BATCH_SIZE = 10000
+
+
+def fake_word(rng, syllables, low=2, high=4):
+    return ''.join(rng.choice(syllables) for _ in range(rng.randint(low, high)))
+
+
+def batches(rows, size=BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def generate(path, users, courses, sections, words, seed):
+    if os.path.exists(path):
+        raise SystemExit(f"{path} exists already, the generator only fills a new database")
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(path)
+    os.environ.setdefault('LEARNING_SESSION_STORE', 'memory')
+    import main as application
+    app = application.create_app()  # creates the schema of the current models in the new database
+    from werkzeug.security import generate_password_hash
+
+    rng = random.Random(seed)
+    # hashing is slow on purpose, so every user gets the same hash
+    password = generate_password_hash(PASSWORD, method="pbkdf2:sha256", salt_length=8)
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA synchronous = OFF")
+    started = time.perf_counter()
+    connection.executemany("INSERT INTO course_table (id, name, language, level, teacher, month, year, code, "
+                           "date_of_creation, belong_to_user_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           ((number, f"Deutsch - A{number % 3 + 1} - Course {number}", 'Deutsch',
+                             f"A{number % 3 + 1}", f"Teacher {number}", 'January', '2024', f"CODE{number:016d}",
+                             'January 01, 2024', number + 1 if number + 1 <= users else None)
+                            for number in range(1, courses + 1)))
+    for batch in batches((number, f"User {number}", f"user{number}@example.com",
+                          rng.randint(1, courses) if number > courses + 1 else None, password,
+                          'January 01, 2024') for number in range(1, users + 1)):
+        connection.executemany("INSERT INTO user_table (id, name, email, study_course_id, password, "
+                               "date_of_register) VALUES (?, ?, ?, ?, ?, ?)", batch)
+    connection.executemany("INSERT INTO section_table (id, name, belong_to_course_id) VALUES (?, ?, ?)",
+                           ((number, f"Section {number}", (number - 1) // sections + 1)
+                            for number in range(1, courses * sections + 1)))
+    for batch in batches((fake_word(rng, SYLLABLES).capitalize(), fake_word(rng, MEANING_SYLLABLES),
+                          rng.choice(GENDERS), f"Beispiel {number}", rng.randint(1, courses * sections))
+                         for number in range(words)):
+        connection.executemany("INSERT INTO word_table (name, meaning, gender, description, belong_to_section_id) "
+                               "VALUES (?, ?, ?, ?, ?)", batch)
+    connection.commit()
+    connection.close()
+    print(f"{users} users, {courses} courses, {courses * sections} sections, {words} words inserted in "
+          f"{time.perf_counter() - started:.1f}s")
+    started = time.perf_counter()
+    with app.app_context():
+        application.search.rebuild_index(application.db.session)
+        application.recount_statistics()
+        application.db.session.commit()
+    print(f"search index and statistics built in {time.perf_counter() - started:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('database', help="path of the sqlite file to create")
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--courses', type=int, default=1000)
+    parser.add_argument('--sections', type=int, default=20, help="sections per course")
+    parser.add_argument('--words', type=int, default=1000000, help="words in total")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    generate(args.database, args.users, args.courses, args.sections, args.words, args.seed)
+
+
+if __name__ == '__main__':
+    main()
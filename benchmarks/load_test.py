@@ -0,0 +1,206 @@
+"""Drive the real routes through the Flask test client and report throughput, latency and SQL statements.
+
+    python benchmarks/generate_data.py /tmp/benchmark.db --users 10000 --courses 1000 --words 1000000
+    python benchmarks/load_test.py /tmp/benchmark.db --threads 4 --output benchmarks/baseline.json
+    python benchmarks/load_test.py /tmp/benchmark.db --threads 4 --baseline benchmarks/baseline.json
+
+With --baseline the run is compared to a saved one and the exit status is 1 if a scenario got slower than the
+tolerance allows or issues more SQL statements per request.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from generate_data import PASSWORD  # noqa: E402
+
+
+class Session:
+    """A test client logged in as one user, with what the scenarios need to know about that user."""
+
+    def __init__(self, app, user_id, email, section_ids):
+        self.client = app.test_client()
+        self.user_id = user_id
+        self.email = email
+        self.section_ids = section_ids
+
+    def login(self):
+        return self.client.post('/login', data={'email': self.email, 'password': PASSWORD})
+
+
+def index(sessions, rng, terms):
+    return [sessions['anonymous'].client.get('/')]
+
+
+def login(sessions, rng, terms):
+    return [sessions['anonymous'].login()]
+
+
+def profile_search(sessions, rng, terms):
+    return [sessions['learner'].client.post('/profile', data={'word': rng.choice(terms)})]
+
+
+def section_manage(sessions, rng, terms):
+    return [sessions['manager'].client.get('/section_manage')]
+
+
+def word_manage(sessions, rng, terms):
+    manager = sessions['manager']
+    return [manager.client.get(f'/word_manage/section/{rng.choice(manager.section_ids)}')]
+
+
+def learning_loop(sessions, rng, terms):
+    learner = sessions['learner']
+    client = learner.client
+    return [client.get(f'/pack_word_list/{rng.choice(learner.section_ids)}'), client.get('/show_answer'),
+            client.get('/select_word'), client.get('/remove_from_list')]
+
+
+SCENARIOS = {'index': index, 'login': login, 'profile search': profile_search, 'section_manage': section_manage,
+             'word_manage': word_manage, 'learning loop': learning_loop}
+# logging in hashes the password on purpose, it gets fewer iterations than the other scenarios
+SCENARIO_WEIGHTS = {'login': 0.1}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def run_scenario(application, app, scenario, iterations, threads, rng, terms):
+    local = threading.local()
+    lock = threading.Lock()
+    latencies = []
+    queries = []
+    errors = []
+
+    # one set of logged in clients per thread, like one browser per user, made before the clock starts
+    prepared = queue.SimpleQueue()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for thread_sessions in executor.map(lambda number: make_sessions(application, app, rng), range(threads)):
+            prepared.put(thread_sessions)
+
+    def sessions():
+        if not hasattr(local, 'sessions'):
+            local.sessions = prepared.get()
+        return local.sessions
+
+    def iteration(number):
+        iteration_rng = random.Random(number)
+        thread_sessions = sessions()
+        started = time.perf_counter()
+        responses = scenario(thread_sessions, iteration_rng, terms)
+        elapsed = time.perf_counter() - started
+        with lock:
+            for response in responses:
+                latencies.append(elapsed / len(responses))
+                queries.append(int(response.headers.get('X-Query-Count', 0)))
+                if response.status_code >= 400:
+                    errors.append(response.status_code)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(iteration, range(iterations)))
+    elapsed = time.perf_counter() - started
+    return {'requests': len(latencies), 'errors': len(errors), 'throughput': round(len(latencies) / elapsed, 2),
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'queries_per_request': round(sum(queries) / len(queries), 2)}
+
+
+def make_sessions(main, app, rng):
+    # runs in a worker thread, which has no application context of its own
+    with app.app_context():
+        course_count = main.db.session.query(main.func.count(main.Course.id)).scalar()
+        user_count = main.db.session.query(main.func.count(main.User.id)).scalar()
+        manager_id = rng.randint(2, course_count + 1)
+        learner_id = rng.randint(course_count + 2, user_count)
+        sessions = {'anonymous': Session(app, None, f"user{learner_id}@example.com", [])}
+        for kind, user_id in [('manager', manager_id), ('learner', learner_id)]:
+            user = main.db.session.get(main.User, user_id)
+            course_id = user.study_course_id or main.Course.query.filter_by(belong_to_user_id=user_id).first().id
+            section_ids = [row[0] for row in
+                           main.db.session.query(main.Section.id).filter_by(belong_to_course_id=course_id)]
+            sessions[kind] = Session(app, user_id, user.email, section_ids)
+    for session in sessions.values():
+        if session.section_ids:
+            session.login()
+    return sessions
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    print(f"\n{'scenario':16} {'p50 ms':>16} {'p99 ms':>16} {'queries/request':>18}")
+    for name, result in results['scenarios'].items():
+        old = baseline.get('scenarios', {}).get(name)
+        if not old:
+            continue
+        print(f"{name:16} {old['p50_ms']:7.2f} -> {result['p50_ms']:7.2f} {old['p99_ms']:7.2f} -> "
+              f"{result['p99_ms']:7.2f} {old['queries_per_request']:8.2f} -> {result['queries_per_request']:7.2f}")
+        if result['p50_ms'] > old['p50_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p50 {old['p50_ms']} ms -> {result['p50_ms']} ms")
+        if result['queries_per_request'] > old['queries_per_request']:
+            regressions.append(f"{name}: {old['queries_per_request']} -> {result['queries_per_request']} "
+                               f"SQL statements per request")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('database', help="database made by generate_data.py")
+    parser.add_argument('--iterations', type=int, default=200, help="iterations per scenario")
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--scenario', action='append', choices=list(SCENARIOS), help="run only these scenarios")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="save the results as json")
+    parser.add_argument('--baseline', help="json of an earlier run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed p50 slow down against the baseline")
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(args.database)
+    os.environ.setdefault('LEARNING_SESSION_STORE', 'memory')
+    os.environ.setdefault('PAGE_CACHE', 'memory')
+    os.environ.setdefault('SLOW_REQUEST_SECONDS', '0')
+    import main as application
+    # X-Query-Count is only sent in testing or debug mode
+    app = application.create_app({'WTF_CSRF_ENABLED': False, 'TESTING': True})
+
+    rng = random.Random(args.seed)
+    with app.app_context():
+        terms = [row[0] for row in application.db.session.query(application.Word.name)
+                 .filter(application.Word.id.in_([rng.randint(1, 1000) for _ in range(200)]))]
+        dataset = {name: application.db.session.query(application.func.count(model.id)).scalar()
+                   for name, model in [('users', application.User), ('courses', application.Course),
+                                       ('sections', application.Section), ('words', application.Word)]}
+    terms += [term[:4] for term in terms] + ['xyzzy']
+    results = {'created': datetime.now().isoformat(timespec='seconds'), 'dataset': dataset, 'threads': args.threads,
+               'scenarios': {}}
+    print(f"dataset: {dataset}, {args.threads} threads")
+    print(f"{'scenario':16} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'queries':>8}")
+    for name in args.scenario or SCENARIOS:
+        iterations = max(1, int(args.iterations * SCENARIO_WEIGHTS.get(name, 1)))
+        result = run_scenario(application, app, SCENARIOS[name], iterations, args.threads, rng, terms)
+        results['scenarios'][name] = result
+        print(f"{name:16} {result['requests']:9} {result['errors']:7} {result['throughput']:9.1f} "
+              f"{result['p50_ms']:9.2f} {result['p99_ms']:9.2f} {result['queries_per_request']:8.2f}")
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=1)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Time the hot lookups of main.py on a large seeded database, before and after the lookup indexes.
+
+    python benchmarks/lookups.py --courses 2000 --sections 50 --words 20
+"""
+import argparse
+import os
+import random
+import sqlite3
+import string
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import migrations  # noqa: E402
+
+
+# the tables as the original main.py created them, without any index besides the primary keys
+BASELINE_SCHEMA = """
+CREATE TABLE user_table (id INTEGER NOT NULL, name VARCHAR(150) NOT NULL, email VARCHAR(250) NOT NULL,
+    study_course VARCHAR(150), password VARCHAR(250) NOT NULL, img VARCHAR(250),
+    date_of_register VARCHAR(150) NOT NULL, extra VARCHAR(150), PRIMARY KEY (id), UNIQUE (email));
+CREATE TABLE course_table (id INTEGER NOT NULL, name VARCHAR(50), language VARCHAR(20), level VARCHAR(20),
+    teacher VARCHAR(50), month VARCHAR(20), year VARCHAR(20), code VARCHAR(20), date_of_creation VARCHAR(50),
+    img VARCHAR(250), belong_to_user_id INTEGER, extra VARCHAR(150), PRIMARY KEY (id),
+    FOREIGN KEY(belong_to_user_id) REFERENCES user_table (id));
+CREATE TABLE section_table (id INTEGER NOT NULL, name VARCHAR(150) NOT NULL, img VARCHAR(250),
+    belong_to_course_id INTEGER, extra VARCHAR(150), PRIMARY KEY (id),
+    FOREIGN KEY(belong_to_course_id) REFERENCES course_table (id));
+CREATE TABLE word_table (id INTEGER NOT NULL, name VARCHAR(150) NOT NULL, meaning VARCHAR(200) NOT NULL,
+    gender VARCHAR(20), description VARCHAR(500), img VARCHAR(250), belong_to_section_id INTEGER,
+    extra VARCHAR(150), PRIMARY KEY (id), FOREIGN KEY(belong_to_section_id) REFERENCES section_table (id));
+"""
+
+# what the views look up now: the study course and sections by id (the primary key, for comparison), courses by code
+# and the foreign keys which the lookup indexes cover
+LOOKUPS = {
+    'register: course by code': ("SELECT id FROM course_table WHERE code = ?", 'code'),
+    'login: courses of a manager': ("SELECT id FROM course_table WHERE belong_to_user_id = ?", 'user_id'),
+    'profile: study course by id': ("SELECT name FROM course_table WHERE id = ?", 'course_id'),
+    'section_manage: section by id': ("SELECT name FROM section_table WHERE id = ?", 'section_id'),
+    'sections of a course': ("SELECT id FROM section_table WHERE belong_to_course_id = ?", 'course_id'),
+    'words of a section': ("SELECT id FROM word_table WHERE belong_to_section_id = ?", 'section_id'),
+}
+
+
+def seed(connection, courses, sections, words):
+    connection.executescript(BASELINE_SCHEMA)
+    codes = [''.join(random.choices(string.ascii_uppercase, k=20)) for _ in range(courses)]
+    # every course has a manager of its own, user n manages course n
+    connection.executemany("INSERT INTO course_table (id, name, code, belong_to_user_id) VALUES (?, ?, ?, ?)",
+                           ((number, f"Course {number}", code, number)
+                            for number, code in enumerate(codes, start=1)))
+    connection.executemany("INSERT INTO section_table (id, name, belong_to_course_id) VALUES (?, ?, ?)",
+                           ((number, f"Section {number}", (number - 1) // sections + 1)
+                            for number in range(1, courses * sections + 1)))
+    connection.executemany("INSERT INTO word_table (name, meaning, belong_to_section_id) VALUES (?, ?, ?)",
+                           ((f"Wort {number}", f"word {number}", (number - 1) // words + 1)
+                            for number in range(1, courses * sections * words + 1)))
+    connection.commit()
+    return codes
+
+
+def run_lookups(connection, codes, courses, sections, repeat):
+    results = {}
+    for label, (query, kind) in LOOKUPS.items():
+        started = time.perf_counter()
+        for _ in range(repeat):
+            course = random.randint(1, courses)
+            section = random.randint(1, courses * sections)
+            value = {'code': random.choice(codes), 'user_id': course, 'course_id': course,
+                     'section_id': section}[kind]
+            connection.execute(query, (value,)).fetchall()
+        results[label] = (time.perf_counter() - started) / repeat * 1000
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--courses', type=int, default=1000)
+    parser.add_argument('--sections', type=int, default=40, help="sections per course")
+    parser.add_argument('--words', type=int, default=25, help="words per section")
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        connection = sqlite3.connect(os.path.join(directory, 'benchmark.db'))
+        print(f"seeding {args.courses} courses, {args.courses * args.sections} sections, "
+              f"{args.courses * args.sections * args.words} words ...")
+        codes = seed(connection, args.courses, args.sections, args.words)
+        before = run_lookups(connection, codes, args.courses, args.sections, args.repeat)
+        migrations.add_lookup_indexes(connection, None, None)
+        connection.commit()
+        after = run_lookups(connection, codes, args.courses, args.sections, args.repeat)
+        connection.close()
+
+    print(f"{'lookup':35} {'before ms':>10} {'after ms':>10} {'speedup':>8}")
+    for label in LOOKUPS:
+        print(f"{label:35} {before[label]:10.3f} {after[label]:10.4f} {before[label] / after[label]:7.0f}x")
+
+
+if __name__ == '__main__':
+    main()
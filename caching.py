@@ -0,0 +1,97 @@
+from collections import OrderedDict
+import os
+import tempfile
+import threading
+import time
+
+
+# Rendered pages are stored by a key which already contains the content versions they were built from, so entries
+# never have to be invalidated one by one: a write bumps a version and the old entries are simply not asked for
+# anymore until they are evicted.
+class MemoryCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=30 * 60):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            saved_at, value = entry
+            if time.time() - saved_at > self.ttl:
+                self.remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            self.remove(key)
+            self.entries[key] = (time.time(), value)
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry:
+            self.size -= len(entry[1])
+
+
+class FileCache:
+    def __init__(self, directory, ttl=30 * 60, max_files=10000):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_files = max_files
+        self.writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, key):
+        path = os.path.join(self.directory, key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path, 'rb') as cached_file:
+                return cached_file.read()
+        except OSError:
+            return None
+
+    def set(self, key, value):
+        # write to a temporary file first, so other workers never read a half written page
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(descriptor, 'wb') as cached_file:
+            cached_file.write(value)
+        os.replace(temporary_path, os.path.join(self.directory, key))
+        self.writes += 1
+        if self.writes % 100 == 0:
+            self.prune()
+
+    def prune(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except OSError:
+                continue
+        entries.sort()
+        expired = time.time() - self.ttl
+        for number, (modified, path) in enumerate(entries):
+            if modified < expired or number < len(entries) - self.max_files:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+def create_cache(kind, directory=None, max_bytes=64 * 1024 * 1024, ttl=30 * 60):
+    if kind == 'memory':
+        return MemoryCache(max_bytes=max_bytes, ttl=ttl)
+    if kind == 'filesystem':
+        return FileCache(directory, ttl=ttl)
+    raise ValueError(f"Unknown page cache: {kind}")
@@ -1,7 +1,22 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, SubmitField, PasswordField, SelectField
-from wtforms.validators import DataRequired, Email
+from flask_wtf.file import FileField, FileRequired, FileAllowed
+from wtforms import StringField, SubmitField, PasswordField, SelectField, SelectMultipleField
+from wtforms.validators import DataRequired, Email, ValidationError
 from flask_ckeditor import CKEditorField
+from media import IMAGE_EXTENSIONS, image_type
+
+
+def image_content(form, field):
+    # the extension is only what the browser claims, the first bytes tell what the file is
+    if field.data:
+        header = field.data.stream.read(16)
+        field.data.stream.seek(0)
+        if image_type(header) is None:
+            raise ValidationError("This File Is Not a Jpeg, Png, Gif or Webp Image")
+
+
+def image_field(label="Image"):
+    return FileField(label, validators=[FileAllowed(IMAGE_EXTENSIONS, "Only Image Files"), image_content])
 
 
 class RegisterForm(FlaskForm):
@@ -25,30 +40,57 @@ class CourseForm(FlaskForm):
     level = StringField("Level", validators=[DataRequired()])
     month = StringField("Month", validators=[DataRequired()])
     year = StringField("Year", validators=[DataRequired()])
+    img = image_field()
     submit = SubmitField("Add This New Course")
 
 
 class SectionForm(FlaskForm):
     name = StringField("Name", validators=[DataRequired()])
+    img = image_field()
     submit = SubmitField("Add This New Section")
 
 
+class MoveSectionsForm(FlaskForm):
+    sections = SelectMultipleField("Sections", coerce=int, validators=[DataRequired()])
+    course = SelectField("To Course", coerce=int)
+    action = SelectField("Action", choices=[('move', 'Move'), ('copy', 'Copy')])
+    submit = SubmitField("Move or Copy These Sections")
+
+
 class WordForm(FlaskForm):
     name = StringField("Word", validators=[DataRequired()])
     meaning = StringField("Meaning", validators=[DataRequired()])
     gender = SelectField("Gender", choices=['', 'der', 'die', 'das'])
     description = CKEditorField("Description")
+    img = image_field()
     submit = SubmitField("Add This New Word")
 
 
+class ImportWordsForm(FlaskForm):
+    file = FileField("CSV, TSV or Anki Text File (word, meaning, gender, description)",
+                     validators=[FileRequired(), FileAllowed(['csv', 'tsv', 'txt'], "Only .csv, .tsv or .txt Files")])
+    submit = SubmitField("Import These Words")
+
+
 class EditWordForm(FlaskForm):
     name = StringField("Word", validators=[DataRequired()])
     meaning = StringField("Meaning", validators=[DataRequired()])
     gender = SelectField("Gender", choices=['', 'der', 'die', 'das'])
     description = CKEditorField("Description")
+    img = image_field("New Image")
     submit = SubmitField("Edit This Word")
 
 
+class ImageForm(FlaskForm):
+    img = image_field("Profile Image")
+    submit = SubmitField("Upload This Image")
+
+
 class SearchForm(FlaskForm):
     word = StringField("Search Bar", validators=[DataRequired()])
-    submit = SubmitField("Search This Word")
\ No newline at end of file
+    submit = SubmitField("Search This Word")
+
+
+class AnswerForm(FlaskForm):
+    answer = StringField("Your Answer (with der, die or das)", validators=[DataRequired()])
+    submit = SubmitField("Check")
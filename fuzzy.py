@@ -0,0 +1,208 @@
+from collections import Counter
+import re
+from sqlalchemy import text, bindparam
+
+
+# Typo tolerant lookup (symmetric delete). Every distinct (folded, article less) word name and meaning is a row of
+# fuzzy_term with the number of words using it, and fuzzy_variant lists, by term length, what is left of the term's
+# first PREFIX_LENGTH letters after deleting up to as many letters as a query could be off by. Two terms within edit
+# distance d of each other (a transposition included) have a common variant with at most d deletions on either side,
+# so a lookup is one index range per variant of the query and only the few terms found have their distance computed.
+# Everything here works on text which went through search.fold() already.
+TERM_TABLE = "fuzzy_term"
+VARIANT_TABLE = "fuzzy_variant"
+ARTICLES = {'der', 'die', 'das'}
+WORD_PATTERN = re.compile(r'\w+')
+SPELLING_PATTERN = re.compile(r'[aou]e|ss')
+TAG_PATTERN = re.compile(r'<[^>]+>')
+MAX_TERM_LENGTH = 100
+MAX_DISTANCE = 2
+PREFIX_LENGTH = 7
+BATCH_SIZE = 500
+
+
+def without_article(folded):
+    words = WORD_PATTERN.findall(folded or '')
+    if len(words) > 1 and words[0] in ARTICLES:
+        words = words[1:]
+    return ' '.join(words)
+
+
+def normalise(folded):
+    # a missing umlaut or ß is the most common misspelling, so "madchen" and "maedchen" get the same key
+    return SPELLING_PATTERN.sub(lambda match: match.group(0)[0], without_article(folded))[:MAX_TERM_LENGTH]
+
+
+def max_distance(length):
+    """How many typos a term of this length may have and still count as the same word."""
+    if length < 4:
+        return 0
+    return 1 if length < 10 else 2
+
+
+def index_depth(length):
+    # the most typos any query which may match a term of this length allows
+    return max(max_distance(query_length) for query_length in range(length - MAX_DISTANCE, length + MAX_DISTANCE + 1)
+               if abs(query_length - length) <= max_distance(query_length))
+
+
+def variants(term, deletions):
+    found = level = {term[:PREFIX_LENGTH]}
+    for _ in range(deletions):
+        level = {variant[:position] + variant[position + 1:] for variant in level for position in range(len(variant))}
+        found = found | level
+    return found
+
+
+def edit_distance(first, second, limit):
+    """Damerau-Levenshtein (optimal string alignment) distance, or limit + 1 as soon as it must be above limit.
+
+    Only the diagonal band of width 2 * limit + 1 is computed, every cell outside of it is above limit anyway."""
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+    over = limit + 1
+    previous_previous = None
+    previous = [column if column <= limit else over for column in range(len(second) + 1)]
+    for row, first_char in enumerate(first, start=1):
+        current = [row if row <= limit else over] + [over] * len(second)
+        best = current[0]
+        for column in range(max(1, row - limit), min(len(second), row + limit) + 1):
+            second_char = second[column - 1]
+            value = previous[column - 1] + (first_char != second_char)
+            if previous[column] + 1 < value:
+                value = previous[column] + 1
+            if current[column - 1] + 1 < value:
+                value = current[column - 1] + 1
+            if row > 1 and column > 1 and first_char == second[column - 2] and first[row - 2] == second_char \
+                    and previous_previous[column - 2] + 1 < value:
+                value = previous_previous[column - 2] + 1
+            current[column] = value if value < over else over
+            if value < best:
+                best = value
+        if best > limit:
+            return over
+        previous_previous, previous = previous, current
+    return previous[-1]
+
+
+def clear_index(session):
+    for table in [TERM_TABLE, VARIANT_TABLE]:
+        session.execute(text(f"DELETE FROM {table}"))
+
+
+def batches(values):
+    values = list(values)
+    for start in range(0, len(values), BATCH_SIZE):
+        yield values[start:start + BATCH_SIZE]
+
+
+def placeholders(values):
+    return ', '.join('?' * len(values))
+
+
+def select_terms(session, columns, terms, condition=''):
+    rows = []
+    for batch in batches(terms):
+        rows.extend(session.execute(text(f"SELECT {columns} FROM {TERM_TABLE} WHERE term IN :terms {condition}")
+                                    .bindparams(bindparam('terms', expanding=True)), {'terms': batch}))
+    return rows
+
+
+def term_variants(rows):
+    return [{'variant': variant, 'size': len(term), 'term_id': term_id} for term_id, term in rows
+            for variant in variants(term, index_depth(len(term)))]
+
+
+def add_terms(session, values):
+    """values: (folded, display) pairs of the word names and meanings which were added."""
+    counts = Counter()
+    displays = {}
+    for folded, display in values:
+        term = normalise(folded)
+        if term:
+            counts[term] += 1
+            displays.setdefault(term, ' '.join(TAG_PATTERN.sub(' ', display or '').split()) or term)
+    if not counts:
+        return
+    existing = dict(select_terms(session, 'term, id', counts))
+    if existing:
+        session.execute(text(f"UPDATE {TERM_TABLE} SET refs = refs + :refs WHERE id = :id"),
+                        [{'id': term_id, 'refs': counts[term]} for term, term_id in existing.items()])
+    new_terms = [term for term in counts if term not in existing]
+    if not new_terms:
+        return
+    session.execute(text(f"INSERT INTO {TERM_TABLE} (term, display, size, refs) "
+                         f"VALUES (:term, :display, :size, :refs)"),
+                    [{'term': term, 'display': displays[term], 'size': len(term), 'refs': counts[term]}
+                     for term in new_terms])
+    session.execute(text(f"INSERT INTO {VARIANT_TABLE} (variant, size, term_id) "
+                         f"VALUES (:variant, :size, :term_id)"),
+                    term_variants(select_terms(session, 'id, term', new_terms)))
+
+
+def remove_terms(session, values):
+    """values: folded word names and meanings which were removed."""
+    counts = Counter(term for term in map(normalise, values) if term)
+    if not counts:
+        return
+    session.execute(text(f"UPDATE {TERM_TABLE} SET refs = refs - :refs WHERE term = :term"),
+                    [{'term': term, 'refs': number} for term, number in counts.items()])
+    unused = select_terms(session, 'id, term', counts, 'AND refs <= 0')
+    if not unused:
+        return
+    session.execute(text(f"DELETE FROM {VARIANT_TABLE} WHERE variant = :variant AND size = :size "
+                         f"AND term_id = :term_id"), term_variants(unused))
+    session.execute(text(f"DELETE FROM {TERM_TABLE} WHERE id IN :ids").bindparams(bindparam('ids', expanding=True)),
+                    {'ids': [term_id for term_id, term in unused]})
+
+
+def suggest(session, folded, limit=5):
+    """Display texts of the known terms closest to a folded query, closest and most used first."""
+    term = normalise(folded)
+    if not term:
+        return []
+    distance = max_distance(len(term))
+    letters = set(term)
+    matches = {}
+    searched = set()
+    # one deletion finds everything within one typo from a handful of rows; the far more common two deletion
+    # variants are only looked up when that did not bring enough suggestions
+    for deletions in range(min(distance, 1), distance + 1):
+        if deletions == 2 and sum(match[0] <= 1 for match in matches.values()) >= limit:
+            break
+        query_variants = tuple(variants(term, deletions) - searched)
+        searched.update(query_variants)
+        # a plain driver statement: compiling an expanding IN costs several times the lookup itself
+        for candidate, display, refs in session.connection().exec_driver_sql(
+                f"SELECT term, display, refs FROM {TERM_TABLE} WHERE id IN (SELECT term_id FROM {VARIANT_TABLE} "
+                f"WHERE variant IN ({placeholders(query_variants)}) AND size BETWEEN ? AND ?)",
+                query_variants + (len(term) - distance, len(term) + distance)):
+            # a typo changes at most two letters of the set of letters used, which is much cheaper to compare
+            if len(letters ^ set(candidate)) > 2 * distance:
+                continue
+            candidate_distance = edit_distance(term, candidate, distance)
+            if candidate_distance <= distance:
+                matches[candidate] = (candidate_distance, -refs, display)
+    return [display for candidate_distance, refs, display in sorted(matches.values())[:limit]]
+
+
+def grade(folded_answer, folded_name, gender=None):
+    """Grade a typed answer against a word: 'correct', 'almost' (a typo or two), 'gender' (wrong article) or
+    'wrong'."""
+    words = WORD_PATTERN.findall(folded_answer or '')
+    article = words.pop(0) if len(words) > 1 and words[0] in ARTICLES else None
+    answer = ' '.join(words)
+    expected = without_article(folded_name)
+    tolerance = max_distance(len(expected))
+    distance = edit_distance(answer, expected, tolerance)
+    gender_correct = None
+    if gender in ARTICLES:
+        gender_correct = article == gender
+    if distance > tolerance:
+        result = 'wrong'
+    elif gender_correct is False:
+        result = 'gender'
+    else:
+        result = 'correct' if distance == 0 else 'almost'
+    return {'grade': result, 'correct': result in ('correct', 'almost'), 'distance': min(distance, tolerance + 1),
+            'gender_correct': gender_correct}
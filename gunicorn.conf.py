@@ -0,0 +1,29 @@
+# gunicorn -c gunicorn.conf.py wsgi:app
+#
+# One process per core with a few threads each. The app is created once in the master (schema upgrade, search index
+# check) and the workers are forked from it, so they start serving right away.
+import multiprocessing
+import os
+import shutil
+
+preload_app = True
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+# keep below DB_POOL_SIZE + DB_MAX_OVERFLOW, every thread may hold a database connection
+threads = int(os.environ.get('THREADS', 4))
+timeout = 60
+# the workers add up their metrics in this folder (see metrics.py); read by create_app() in the preloaded app
+os.environ.setdefault('METRICS_FOLDER', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'metrics'))
+
+
+def on_starting(server):
+    # the counters start from zero with the server, not with what the workers of the last run left behind
+    shutil.rmtree(os.environ['METRICS_FOLDER'], ignore_errors=True)
+
+
+def post_fork(server, worker):
+    # threads don't survive a fork; every worker runs background jobs, including those left behind by a worker that
+    # died
+    import main
+    main.job_queue.start()
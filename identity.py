@@ -0,0 +1,67 @@
+from collections import OrderedDict
+import threading
+import time
+from flask_login import UserMixin
+
+
+ADMIN_USER_ID = 1
+
+
+# What the login manager hands out as current_user: the user's own columns plus the ids of the courses they manage,
+# read in one query instead of a User object whose has_courses is lazy loaded by every role check.
+class Identity(UserMixin):
+    def __init__(self, id, name, email, img, study_course_id, course_ids):
+        self.id = id
+        self.name = name
+        self.email = email
+        self.img = img
+        self.study_course_id = study_course_id
+        self.course_ids = course_ids
+        self.loaded_at = time.time()
+
+    @property
+    def is_admin(self):
+        return self.id == ADMIN_USER_ID
+
+    @property
+    def is_course_manager(self):
+        return bool(self.course_ids)
+
+    @property
+    def role(self):
+        if self.is_admin:
+            return 'admin'
+        return 'course_manager' if self.is_course_manager else 'learner'
+
+
+class IdentityCache:
+    def __init__(self, max_size=10000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.identities = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id, changed_at=0):
+        # changed_at comes from the user's session, so a change the user made is seen by every worker right away;
+        # changes made by somebody else show up after ttl at the latest
+        with self.lock:
+            identity = self.identities.get(user_id)
+            if identity is None:
+                return None
+            if identity.loaded_at < changed_at or time.time() - identity.loaded_at > self.ttl:
+                del self.identities[user_id]
+                return None
+            self.identities.move_to_end(user_id)
+            return identity
+
+    def set(self, identity):
+        with self.lock:
+            self.identities[identity.id] = identity
+            self.identities.move_to_end(identity.id)
+            while len(self.identities) > self.max_size:
+                self.identities.popitem(last=False)
+
+    def invalidate(self, *user_ids):
+        with self.lock:
+            for user_id in user_ids:
+                self.identities.pop(user_id, None)
@@ -0,0 +1,214 @@
+from contextlib import closing, nullcontext
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+
+# Background jobs for work that is too slow for a request. Jobs are rows of a sqlite table, so every web worker
+# process can enqueue and poll them and they survive a restart. A process starts its pool of worker threads when it
+# enqueues its first job; a worker claims one job at a time in an IMMEDIATE transaction, so a job runs once however
+# many processes poll, and holds it for `lease` seconds, extended by every progress report. A job whose worker died
+# is taken over when its lease ran out.
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+COLUMNS = ['id', 'name', 'payload', 'user_id', 'status', 'attempts', 'max_attempts', 'run_at', 'locked_until',
+           'progress', 'total', 'message', 'result', 'error', 'created_at', 'finished_at']
+KEEP_FINISHED = 7 * 24 * 60 * 60
+
+logger = logging.getLogger(__name__)
+
+
+class JobFailed(Exception):
+    pass
+
+
+class Task:
+    def __init__(self, function, concurrency, max_attempts, backoff):
+        self.function = function
+        # how many jobs of this task may run at the same time, over all processes
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        # seconds before the first retry, doubled for every further one
+        self.backoff = backoff
+
+
+class Job:
+    """What a task function gets as its first argument."""
+
+    def __init__(self, queue, job_id, attempt, max_attempts):
+        self.queue = queue
+        self.id = job_id
+        self.attempt = attempt
+        # no retry follows if this attempt fails
+        self.final = attempt >= max_attempts
+
+    def progress(self, done, total=None, message=None):
+        self.queue.report(self.id, done, total, message)
+
+
+class JobQueue:
+    def __init__(self, path=None, workers=2, poll_interval=1.0, lease=5 * 60, context=None):
+        self.path = None
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.context = None
+        self.tasks = {}
+        self.threads = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        if path:
+            self.configure(path, workers, context)
+
+    def configure(self, path, workers=2, context=None):
+        """Tasks can be registered before the queue knows its database, create_app() calls this."""
+        self.path = path
+        self.workers = workers
+        # context() is entered around every job, main.py passes app.app_context
+        self.context = context
+        with closing(self.connect()) as connection, connection:
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS job (id INTEGER PRIMARY KEY, name TEXT NOT NULL, "
+                               "payload TEXT NOT NULL, user_id INTEGER, status TEXT NOT NULL, "
+                               "attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL, "
+                               "run_at REAL NOT NULL, locked_until REAL, progress INTEGER, total INTEGER, "
+                               "message TEXT, result TEXT, error TEXT, created_at REAL NOT NULL, finished_at REAL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS job_status_run_at ON job (status, run_at)")
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=15)
+
+    def task(self, name=None, concurrency=1, max_attempts=3, backoff=5.0):
+        """Register a function as a task; it is called as function(job, **payload) and its return value, which has
+        to be json serialisable, is the job's result."""
+        def decorator(function):
+            self.tasks[name or function.__name__] = Task(function, concurrency, max_attempts, backoff)
+            return function
+
+        return decorator
+
+    def enqueue(self, name, payload=None, user_id=None, delay=0):
+        if name not in self.tasks:
+            raise ValueError(f"Unknown task: {name}")
+        now = time.time()
+        with closing(self.connect()) as connection, connection:
+            job_id = connection.execute("INSERT INTO job (name, payload, user_id, status, max_attempts, run_at, "
+                                        "created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                        (name, json.dumps(payload or {}), user_id, QUEUED,
+                                         self.tasks[name].max_attempts, now + delay, now)).lastrowid
+            connection.execute("DELETE FROM job WHERE status IN (?, ?) AND finished_at < ?",
+                               (DONE, FAILED, now - KEEP_FINISHED))
+        self.start()
+        self.wakeup.set()
+        return job_id
+
+    def status(self, job_id):
+        """The job's row as a dict with payload and result decoded, or None if there is no such job."""
+        with closing(self.connect()) as connection:
+            row = connection.execute(f"SELECT {', '.join(COLUMNS)} FROM job WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(COLUMNS, row))
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        return job
+
+    def result(self, job_id):
+        """The return value of a finished job, None while it is queued or running; JobFailed once it gave up."""
+        job = self.status(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        if job['status'] == FAILED:
+            raise JobFailed(job['error'])
+        return job['result']
+
+    def report(self, job_id, done, total=None, message=None):
+        with closing(self.connect()) as connection, connection:
+            connection.execute("UPDATE job SET progress = ?, total = coalesce(?, total), "
+                               "message = coalesce(?, message), locked_until = ? WHERE id = ?",
+                               (done, total, message, time.time() + self.lease, job_id))
+
+    def start(self):
+        with self.lock:
+            if self.threads or self.workers <= 0:
+                return
+            self.stopping.clear()
+            for number in range(self.workers):
+                thread = threading.Thread(target=self.work, name=f'job-worker-{number}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def stop(self, timeout=None):
+        self.stopping.set()
+        self.wakeup.set()
+        with self.lock:
+            threads, self.threads = self.threads, []
+        for thread in threads:
+            thread.join(timeout)
+
+    def work(self):
+        while not self.stopping.is_set():
+            try:
+                claimed = self.claim()
+            except sqlite3.OperationalError:
+                logger.exception("Could not claim a job")
+                claimed = None
+            if claimed is None:
+                self.wakeup.wait(self.poll_interval)
+                self.wakeup.clear()
+                continue
+            self.run(*claimed)
+
+    def claim(self):
+        now = time.time()
+        with closing(self.connect()) as connection:
+            connection.isolation_level = None
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute("UPDATE job SET status = ?, error = 'The worker running it stopped', "
+                                   "finished_at = ? WHERE status = ? AND locked_until < ? AND attempts >= max_attempts",
+                                   (FAILED, now, RUNNING, now))
+                running = dict(connection.execute("SELECT name, count(*) FROM job WHERE status = ? "
+                                                  "AND locked_until >= ? GROUP BY name", (RUNNING, now)))
+                names = [name for name, task in self.tasks.items() if running.get(name, 0) < task.concurrency]
+                row = None
+                if names:
+                    row = connection.execute(
+                        f"SELECT id, name, payload, attempts + 1, max_attempts FROM job "
+                        f"WHERE name IN ({', '.join('?' * len(names))}) AND (status = ? AND run_at <= ? "
+                        f"OR status = ? AND locked_until < ?) ORDER BY run_at, id LIMIT 1",
+                        (*names, QUEUED, now, RUNNING, now)).fetchone()
+                if row:
+                    connection.execute("UPDATE job SET status = ?, attempts = ?, locked_until = ? WHERE id = ?",
+                                       (RUNNING, row[3], now + self.lease, row[0]))
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        return row
+
+    def run(self, job_id, name, payload, attempt, max_attempts):
+        task = self.tasks[name]
+        try:
+            with self.context() if self.context else nullcontext():
+                result = task.function(Job(self, job_id, attempt, max_attempts), **json.loads(payload))
+            result = json.dumps(result)
+        except Exception as error:
+            logger.exception("Job %s (%s) failed, attempt %d of %d", job_id, name, attempt, max_attempts)
+            if attempt < max_attempts:
+                self.finish(job_id, QUEUED, error=repr(error), run_at=time.time() + task.backoff * 2 ** (attempt - 1))
+            else:
+                self.finish(job_id, FAILED, error=repr(error))
+        else:
+            self.finish(job_id, DONE, result=result)
+
+    def finish(self, job_id, status, result=None, error=None, run_at=None):
+        now = time.time()
+        with closing(self.connect()) as connection, connection:
+            connection.execute("UPDATE job SET status = ?, result = ?, error = ?, run_at = coalesce(?, run_at), "
+                               "locked_until = NULL, finished_at = ? WHERE id = ?",
+                               (status, result, error, run_at, None if status == QUEUED else now, job_id))
+        if status == QUEUED:
+            self.wakeup.set()
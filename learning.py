@@ -0,0 +1,143 @@
+from array import array
+from collections import OrderedDict
+from contextlib import closing
+from datetime import datetime, timedelta
+import random
+import sqlite3
+import threading
+import time
+
+
+# Every learner gets an own deck (keyed by user id) instead of the old module level word_list, so learners don't
+# share state and several worker processes can serve the same learner when the sqlite store is used.
+class Deck:
+    def __init__(self, section_id, word_ids, current=None, position=-1, revealed=False):
+        self.section_id = section_id
+        self.word_ids = word_ids if isinstance(word_ids, array) else array('q', word_ids)
+        self.current = current
+        self.position = position
+        self.revealed = revealed
+
+    def __len__(self):
+        return len(self.word_ids)
+
+    def draw(self):
+        self.revealed = False
+        if not self.word_ids:
+            self.current = None
+            self.position = -1
+        else:
+            self.position = random.randrange(len(self.word_ids))
+            self.current = self.word_ids[self.position]
+        return self.current
+
+    def remove_current(self):
+        # swap the drawn card with the last one and pop it, so removing never scans the deck
+        if 0 <= self.position < len(self.word_ids) and self.word_ids[self.position] == self.current:
+            last = self.word_ids.pop()
+            if self.position < len(self.word_ids):
+                self.word_ids[self.position] = last
+        self.current = None
+        self.position = -1
+        self.revealed = False
+
+    def remove_ids(self, word_ids):
+        # progress from the browser arrives in batches, so one pass over the deck handles the whole batch
+        word_ids = set(word_ids)
+        self.word_ids = array('q', [word_id for word_id in self.word_ids if word_id not in word_ids])
+        if self.current in word_ids:
+            self.current = None
+            self.revealed = False
+        self.position = self.word_ids.index(self.current) if self.current else -1
+
+
+class MemoryDeckStore:
+    def __init__(self, max_size=10000, ttl=6 * 60 * 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.decks = OrderedDict()
+        self.lock = threading.Lock()
+
+    def load(self, user_id):
+        with self.lock:
+            entry = self.decks.get(user_id)
+            if entry is None:
+                return None
+            saved_at, deck = entry
+            if time.time() - saved_at > self.ttl:
+                del self.decks[user_id]
+                return None
+            self.decks.move_to_end(user_id)
+            return deck
+
+    def save(self, user_id, deck):
+        with self.lock:
+            self.decks[user_id] = (time.time(), deck)
+            self.decks.move_to_end(user_id)
+            while len(self.decks) > self.max_size:
+                self.decks.popitem(last=False)
+
+    def delete(self, user_id):
+        with self.lock:
+            self.decks.pop(user_id, None)
+
+
+class SQLiteDeckStore:
+    def __init__(self, path, ttl=6 * 60 * 60):
+        self.path = path
+        self.ttl = ttl
+        with closing(self.connect()) as connection, connection:
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS learning_deck (user_id INTEGER PRIMARY KEY, "
+                               "section_id INTEGER, word_ids BLOB, current INTEGER, position INTEGER, "
+                               "revealed INTEGER, saved_at REAL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS learning_deck_saved_at ON learning_deck (saved_at)")
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def load(self, user_id):
+        with closing(self.connect()) as connection:
+            row = connection.execute("SELECT section_id, word_ids, current, position, revealed, saved_at "
+                                     "FROM learning_deck WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None or time.time() - row[5] > self.ttl:
+            return None
+        word_ids = array('q')
+        word_ids.frombytes(row[1])
+        return Deck(row[0], word_ids, current=row[2], position=row[3], revealed=bool(row[4]))
+
+    def save(self, user_id, deck):
+        with closing(self.connect()) as connection, connection:
+            connection.execute("INSERT OR REPLACE INTO learning_deck VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (user_id, deck.section_id, deck.word_ids.tobytes(), deck.current, deck.position,
+                                int(deck.revealed), time.time()))
+            connection.execute("DELETE FROM learning_deck WHERE saved_at < ?", (time.time() - self.ttl,))
+
+    def delete(self, user_id):
+        with closing(self.connect()) as connection, connection:
+            connection.execute("DELETE FROM learning_deck WHERE user_id = ?", (user_id,))
+
+
+# Leitner boxes: a word that is known moves one box up and comes back after the interval of its new box,
+# a word that had to be looked up again falls back to the first box.
+LEITNER_INTERVALS = [timedelta(0), timedelta(days=1), timedelta(days=2), timedelta(days=4), timedelta(days=8),
+                     timedelta(days=16), timedelta(days=32)]
+# a word counts as mastered once it was known this many times in a row
+MASTERED_BOX = 3
+
+
+def schedule(box, correct, now=None):
+    now = now or datetime.utcnow()
+    if correct:
+        box = min((box or 0) + 1, len(LEITNER_INTERVALS) - 1)
+    else:
+        box = 0
+    return box, now + LEITNER_INTERVALS[box]
+
+
+def create_store(kind, path=None, max_size=10000, ttl=6 * 60 * 60):
+    if kind == 'memory':
+        return MemoryDeckStore(max_size=max_size, ttl=ttl)
+    if kind == 'sqlite':
+        return SQLiteDeckStore(path, ttl=ttl)
+    raise ValueError(f"Unknown learning session store: {kind}")
@@ -1,27 +1,63 @@
-from flask import Flask, render_template, redirect, url_for, flash, abort
+from flask import Flask, Blueprint, render_template, redirect, url_for, flash, abort, request, jsonify, g, \
+    has_request_context, Response, stream_with_context, session, make_response, send_from_directory, current_app, \
+    before_render_template, template_rendered
 from flask_bootstrap import Bootstrap
-from datetime import date
+from datetime import date, datetime, timedelta, timezone
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import safe_join
+from werkzeug.local import LocalProxy
+from werkzeug.utils import secure_filename
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import relationship
+from flask_wtf.csrf import generate_csrf
+from markupsafe import Markup
+from sqlalchemy import event, func, insert, select, update, delete, literal, case, bindparam
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import relationship, selectinload, joinedload
 from flask_login import UserMixin, login_user, LoginManager, login_required, current_user, logout_user
-from forms import LoginForm, WordForm, CourseForm, SectionForm, EditWordForm, RegisterForm, SearchForm
+from forms import LoginForm, WordForm, CourseForm, SectionForm, EditWordForm, RegisterForm, SearchForm, \
+    ImportWordsForm, MoveSectionsForm, ImageForm, AnswerForm
 from functools import wraps
+import assets
+import caching
+import identity
+import jobs
+import learning
+import media
+import metrics
+import migrations
+import search
+import vocabulary
+import csv
+import hashlib
+import mimetypes
 import os
 import random
+import secrets
 import string
+import tempfile
+import time
 import random
 
 
 # CONNECT TO DB
-app = Flask(__name__)
-SECRET_KEY = os.urandom(32)
-app.config['SECRET_KEY'] = SECRET_KEY
-Bootstrap(app)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///deutsch.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
-app.app_context().push()
+# Nothing is bound to an application at import time: create_app() at the end of this file configures one, and the
+# views below are registered on it through these blueprints.
+db = SQLAlchemy()
+login_manager = LoginManager()
+site = Blueprint('site', __name__)
+api = Blueprint('api', __name__, url_prefix='/api')
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # sqlite only enforces foreign keys (and ON DELETE CASCADE) when asked to, once per connection. WAL lets readers
+    # go on while somebody writes, and with it synchronous=NORMAL is still safe against corruption.
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys = ON")
+    cursor.execute("PRAGMA journal_mode = WAL")
+    cursor.execute("PRAGMA synchronous = NORMAL")
+    cursor.execute("PRAGMA busy_timeout = 15000")
+    cursor.close()
 
 
 # ----------------------------------------------- CONFIGURE TABLES ------------------------------------------
@@ -30,40 +66,42 @@ class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(150), nullable=False)
     email = db.Column(db.String(250), unique=True, nullable=False)
-    study_course = db.Column(db.String(150), nullable=True)
+    study_course_id = db.Column(db.Integer, db.ForeignKey('course_table.id', ondelete='SET NULL'), index=True)
+    study_course = relationship("Course", foreign_keys=[study_course_id])
     password = db.Column(db.String(250), nullable=False)
     img = db.Column(db.String(250), nullable=True)
     date_of_register = db.Column(db.String(150), nullable=False)
-    has_courses = relationship("Course", back_populates="belong_to_user")
+    has_courses = relationship("Course", back_populates="belong_to_user", foreign_keys="Course.belong_to_user_id")
     extra = db.Column(db.String(150), nullable=True)
 
 
 class Course(db.Model):
     __tablename__ = "course_table"
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(50), nullable=True)
+    name = db.Column(db.String(50), nullable=True, index=True)
     language = db.Column(db.String(20), nullable=True)
     level = db.Column(db.String(20), nullable=True)
     teacher = db.Column(db.String(50), nullable=True)
     month = db.Column(db.String(20), nullable=True)
     year = db.Column(db.String(20), nullable=True)
-    code = db.Column(db.String(20), nullable=True)
+    code = db.Column(db.String(20), nullable=True, index=True)
     date_of_creation = db.Column(db.String(50), nullable=True)
     img = db.Column(db.String(250))
-    belong_to_user = relationship("User", back_populates="has_courses")
-    belong_to_user_id = db.Column(db.Integer, db.ForeignKey('user_table.id'))
-    has_section = relationship("Section", back_populates="belong_to_course")
+    belong_to_user = relationship("User", back_populates="has_courses", foreign_keys="Course.belong_to_user_id")
+    belong_to_user_id = db.Column(db.Integer, db.ForeignKey('user_table.id'), index=True)
+    has_section = relationship("Section", back_populates="belong_to_course", cascade="all, delete",
+                               passive_deletes=True)
     extra = db.Column(db.String(150), nullable=True)
 
 
 class Section(db.Model):
     __tablename__ = "section_table"
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(150), nullable=False)
+    name = db.Column(db.String(150), nullable=False, index=True)
     img = db.Column(db.String(250), nullable=True)
     belong_to_course = relationship("Course", back_populates="has_section")
-    belong_to_course_id = db.Column(db.Integer, db.ForeignKey('course_table.id'))
-    has_word = relationship("Word", back_populates="belong_to_section")
+    belong_to_course_id = db.Column(db.Integer, db.ForeignKey('course_table.id', ondelete='CASCADE'), index=True)
+    has_word = relationship("Word", back_populates="belong_to_section", cascade="all, delete", passive_deletes=True)
     extra = db.Column(db.String(150), nullable=True)
 
 
@@ -76,28 +114,356 @@ class Word(db.Model):
     description = db.Column(db.String(500), nullable=True)
     img = db.Column(db.String(250), nullable=True)
     belong_to_section = relationship("Section", back_populates="has_word")
-    belong_to_section_id = db.Column(db.Integer, db.ForeignKey('section_table.id'))
+    belong_to_section_id = db.Column(db.Integer, db.ForeignKey('section_table.id', ondelete='CASCADE'), index=True)
     extra = db.Column(db.String(150), nullable=True)
 
+
+class ReviewState(db.Model):
+    __tablename__ = "review_table"
+    __table_args__ = (db.UniqueConstraint('user_id', 'word_id', name='review_user_word'),
+                      db.Index('review_user_due', 'user_id', 'due_at'),
+                      db.Index('review_user_section_due', 'user_id', 'section_id', 'due_at'))
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user_table.id', ondelete='CASCADE'), nullable=False)
+    word_id = db.Column(db.Integer, db.ForeignKey('word_table.id', ondelete='CASCADE'), nullable=False)
+    section_id = db.Column(db.Integer, db.ForeignKey('section_table.id', ondelete='CASCADE'))
+    box = db.Column(db.Integer, nullable=False, default=0)
+    due_at = db.Column(db.DateTime, nullable=False)
+    reviewed_at = db.Column(db.DateTime, nullable=True)
+
+
+# Learning analytics: every answer is appended to learning_event_table and, in the same transaction, added to the
+# per (user, section) and per (course, word) summaries, so the dashboards read a few summary rows whatever the number
+# of events.
+class LearningEvent(db.Model):
+    __tablename__ = "learning_event_table"
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user_table.id', ondelete='CASCADE'), nullable=False)
+    word_id = db.Column(db.Integer, nullable=False)
+    section_id = db.Column(db.Integer)
+    course_id = db.Column(db.Integer)
+    correct = db.Column(db.Boolean, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+
+class SectionProgress(db.Model):
+    __tablename__ = "section_progress_table"
+    __table_args__ = (db.Index('section_progress_section', 'section_id'),)
+    user_id = db.Column(db.Integer, db.ForeignKey('user_table.id', ondelete='CASCADE'), primary_key=True)
+    section_id = db.Column(db.Integer, db.ForeignKey('section_table.id', ondelete='CASCADE'), primary_key=True)
+    seen = db.Column(db.Integer, nullable=False, default=0)
+    mastered = db.Column(db.Integer, nullable=False, default=0)
+    learned = db.Column(db.Integer, nullable=False, default=0)
+    missed = db.Column(db.Integer, nullable=False, default=0)
+    reviewed_at = db.Column(db.DateTime)
+
+
+class WordProgress(db.Model):
+    __tablename__ = "word_progress_table"
+    __table_args__ = (db.Index('word_progress_course_difficulty', 'course_id', 'difficulty'),)
+    course_id = db.Column(db.Integer, db.ForeignKey('course_table.id', ondelete='CASCADE'), primary_key=True)
+    word_id = db.Column(db.Integer, db.ForeignKey('word_table.id', ondelete='CASCADE'), primary_key=True)
+    learned = db.Column(db.Integer, nullable=False, default=0)
+    missed = db.Column(db.Integer, nullable=False, default=0)
+    # see word_difficulty()
+    difficulty = db.Column(db.Float, nullable=False, default=0.5)
+
+
+class Counter(db.Model):
+    __tablename__ = "counter_table"
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+
+# ----------------------------------------------- Instrumentation ------------------------------------------
+# Every request records its duration, its SQL statements and the time spent in them and in templates, per endpoint
+# (metrics.py, served at /metrics, added up over the worker processes). Requests slower than SLOW_REQUEST_SECONDS are
+# logged, 0 turns that off.
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+        if context is not None:
+            context.query_started = time.perf_counter()
+
+
+def time_query(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'query_started', None)
+    if started is not None and has_request_context():
+        g.query_seconds = g.get('query_seconds', 0.0) + time.perf_counter() - started
+
+
+def start_template_timer(sender, template, context, **extra):
+    g.template_started = time.perf_counter()
+
+
+def stop_template_timer(sender, template, context, **extra):
+    started = g.pop('template_started', None)
+    if started is not None:
+        metrics.TEMPLATE_SECONDS.observe(time.perf_counter() - started, template.name)
+
+
+@site.before_app_request
+def reset_query_count():
+    g.request_started = time.perf_counter()
+    g.query_count = 0
+    g.query_seconds = 0.0
+
+
+@site.after_app_request
+def add_query_count(response):
+    duration = time.perf_counter() - g.get('request_started', time.perf_counter())
+    endpoint = request.endpoint or 'unknown'
+    query_count = g.get('query_count', 0)
+    query_seconds = g.get('query_seconds', 0.0)
+    metrics.REQUESTS.inc(endpoint, request.method, response.status_code)
+    metrics.REQUEST_SECONDS.observe(duration, endpoint)
+    metrics.QUERIES.observe(query_count, endpoint)
+    metrics.QUERY_SECONDS.observe(query_seconds, endpoint)
+    metrics.flush()
+    if current_app.config['SLOW_REQUEST_SECONDS'] and duration >= current_app.config['SLOW_REQUEST_SECONDS']:
+        current_app.logger.warning("Slow request %s %s (%s): %.3fs, %d SQL statements in %.3fs", request.method,
+                                   request.full_path, endpoint, duration, query_count, query_seconds)
+    if current_app.testing or current_app.debug:
+        response.headers['X-Query-Count'] = str(query_count)
+    return response
+
 # ----------------------------------------------- Forms ------------------------------------------
 
 
 # ----------------------------------------------- route controllers ------------------------------------------
 
 
-@app.route('/')
+@site.route('/')
 def index():
-    user_counter = len(db.session.query(User).all())
-    word_counter = len(db.session.query(Word).all())
-    course_counter = len(db.session.query(Course).all())
+    counters = statistics()
     user_name = ''
     if current_user.is_authenticated:
         user_name = current_user.name
     return render_template("index.html", logged_in=current_user.is_authenticated, user_name=user_name,
-                           user_counter=user_counter, word_counter=word_counter, course_counter=course_counter)
+                           user_counter=counters['users'], word_counter=counters['words'],
+                           course_counter=counters['courses'])
+
+
+# The landing page statistics are kept in counter_table. The write routes bump them in their own transaction and
+# they are recounted with COUNT(*) once they get older than STATISTICS_TTL, in case something changed the tables
+# directly.
+COUNTED_MODELS = {'users': User, 'words': Word, 'courses': Course}
+STATISTICS_TTL = timedelta(hours=1)
+
+
+def statistics():
+    counters = {counter.name: counter for counter in Counter.query.filter(Counter.name.in_(COUNTED_MODELS))}
+    oldest = min((counter.updated_at for counter in counters.values()), default=None)
+    if counters.keys() != COUNTED_MODELS.keys() or datetime.utcnow() - oldest > STATISTICS_TTL:
+        return recount_statistics()
+    return {name: counter.value for name, counter in counters.items()}
+
+
+def recount_statistics():
+    values = {}
+    for name, model in COUNTED_MODELS.items():
+        values[name] = db.session.query(func.count(model.id)).scalar()
+        db.session.merge(Counter(name=name, value=values[name], updated_at=datetime.utcnow()))
+    db.session.commit()
+    return values
+
+
+def bump_counter(name, amount=1):
+    Counter.query.filter_by(name=name).update({Counter.value: Counter.value + amount})
+
+
+# ----------------------------------------------- Static assets ------------------------------------------
+# `python assets.py` builds static/build/ (see assets.py). Once its manifest is there, url_for('static') hands out the
+# content hashed names, which are served precompressed when the browser accepts it and cached for a year. The debug
+# server always hands out the sources, they may be edited while it runs.
+asset_manifest = LocalProxy(lambda: assets.empty_manifest() if current_app.debug
+                            else current_app.extensions['asset_manifest'])
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+PRECOMPRESSED = [('br', '.br'), ('gzip', '.gz')]
+
+
+@site.app_url_defaults
+def hashed_static_url(endpoint, values):
+    if endpoint == 'static' and values.get('filename') in asset_manifest['files']:
+        values['filename'] = assets.BUILD_DIRECTORY + '/' + asset_manifest['files'][values['filename']]
+
+
+def static_file(filename):
+    if not filename.startswith(assets.BUILD_DIRECTORY + '/'):
+        return current_app.send_static_file(filename)
+    path = safe_join(current_app.static_folder, filename)
+    if path is None:
+        abort(404)
+    encoding = None
+    for accepted, suffix in PRECOMPRESSED:
+        if request.accept_encodings[accepted] and os.path.isfile(path + suffix):
+            encoding = accepted
+            filename += suffix
+            break
+    response = send_from_directory(current_app.static_folder, filename, max_age=ASSET_MAX_AGE,
+                                   mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+    if os.path.isfile(path + '.gz'):
+        response.vary.add('Accept-Encoding')
+    if encoding:
+        response.content_encoding = encoding
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@site.app_template_global('image_sources')
+def image_sources(filename):
+    """[(mime type, srcset)] of the built variants of an image, best format first."""
+    sources = {}
+    for variant in asset_manifest['variants'].get(filename, []):
+        url = url_for('static', filename=assets.BUILD_DIRECTORY + '/' + variant['path'])
+        sources.setdefault(variant['type'], []).append(f"{url} {variant['width']}w")
+    return [(mime_type, ', '.join(srcset)) for mime_type, srcset in sources.items()]
+
+
+@site.app_template_global('masthead_style')
+def masthead_style(filename):
+    # a background image has no srcset, so every breakpoint gets a media query with an image-set of the formats
+    fallback = url_for('static', filename=filename)
+    rules = [f".masthead {{ background-image: url('{fallback}'); }}"]
+    widths = {}
+    for variant in asset_manifest['variants'].get(filename, []):
+        widths.setdefault(variant['width'], []).append(variant)
+    for number, width in enumerate(sorted(widths)):
+        image_set = ', '.join(f"url('{url_for('static', filename=assets.BUILD_DIRECTORY + '/' + variant['path'])}') "
+                              f"type('{variant['type']}')" for variant in widths[width])
+        rule = f".masthead {{ background-image: image-set({image_set}); }}"
+        if number < len(widths) - 1:
+            rule = f"@media (max-width: {width}px) {{ {rule} }}"
+        rules.insert(1, rule)
+    return Markup('<style>' + ' '.join(rules) + '</style>')
+
+
+# ----------------------------------------------- Uploaded images ------------------------------------------
+# img columns hold the content hash name of an upload (see media.py). Stored files never change, so they are cached
+# for good; a thumbnail the pool hasn't written yet is answered with its original in the meantime.
+def save_image(field):
+    return media.save_upload(current_app.config['MEDIA_FOLDER'], field.data.stream,
+                             workers=current_app.config['MEDIA_WORKERS'])
+
+
+@site.app_template_global('media_url')
+def media_url(name, size=None):
+    if not name:
+        return ''
+    return url_for('site.media_file', name=media.thumbnail_name(name, size) if size else name)
+
+
+@site.route('/media/<name>')
+def media_file(name):
+    directory = current_app.config['MEDIA_FOLDER']
+    if not media.MEDIA_NAME.match(name):
+        abort(404)
+    if not os.path.isfile(media.media_path(directory, name)):
+        original = media.original_name(directory, name)
+        if original is None:
+            abort(404)
+        media.queue_thumbnails(directory, original, workers=current_app.config['MEDIA_WORKERS'])
+        return redirect(url_for('site.media_file', name=original))
+    response = send_from_directory(os.path.join(directory, name[:2]), name, max_age=ASSET_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+# ----------------------------------------------- Background jobs ------------------------------------------
+# Deleting a course, copying sections and importing a word file run as jobs (see jobs.py); the route enqueues one and
+# returns, and admin_job or import_words shows its status, or an API client polls /jobs/<id>.
+job_queue = jobs.JobQueue()
+
+
+@site.route('/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    job = job_queue.status(job_id)
+    if job is None or (job['user_id'] != current_user.id and not current_user.is_admin):
+        abort(404)
+    return jsonify({key: job[key] for key in ['id', 'name', 'status', 'attempts', 'progress', 'total', 'message',
+                                              'result', 'error']})
+
+
+# ----------------------------------------------- Page cache ------------------------------------------
+# Read heavy pages are cached as rendered html. Their cache key is built from the versions of the content they show
+# ('version:courses', 'version:course:<id>', 'version:section:<id>' rows of counter_table), which the write routes
+# bump in their own transaction, so every worker sees a change on the next request.
+page_cache = LocalProxy(lambda: current_app.extensions['page_cache'])
+
+
+def bump_versions(*names):
+    now = datetime.utcnow()
+    for name in names:
+        db.session.execute(sqlite_insert(Counter).values(name='version:' + name, value=1, updated_at=now)
+                           .on_conflict_do_update(index_elements=['name'],
+                                                  set_={'value': Counter.value + 1, 'updated_at': now}))
+
+
+def bump_section_versions(*section_ids):
+    course_ids = {row[0] for row in db.session.query(Section.belong_to_course_id).filter(Section.id.in_(section_ids))}
+    bump_versions(*[f'section:{section_id}' for section_id in section_ids],
+                  *[f'course:{course_id}' for course_id in course_ids])
+
+
+def not_modified_since(last_modified):
+    # If-None-Match wins when a client sends both; the header only has whole seconds and the stamps are naive utc
+    if request.if_none_match or not request.if_modified_since or last_modified is None:
+        return False
+    return last_modified.replace(microsecond=0, tzinfo=timezone.utc) <= request.if_modified_since
+
+
+def cached_page(versions):
+    # versions(**view_args) returns the names of the versions the page is built from
+    def decorator(f):
+        @wraps(f)
+        def decorated_function3(*args, **kwargs):
+            if request.method != 'GET' or '_flashes' in session:
+                return f(*args, **kwargs)
+            generate_csrf()
+            names = ['version:' + name for name in versions(*args, **kwargs)]
+            stamps = {counter.name: counter for counter in Counter.query.filter(Counter.name.in_(names))}
+            # the session's csrf token is part of the key, because the cached forms carry it
+            key = hashlib.sha1(repr((request.full_path, current_user.get_id(), session.get('csrf_token'),
+                                     [(name, stamps[name].value if name in stamps else 0) for name in names]))
+                               .encode()).hexdigest()
+            last_modified = max((stamp.updated_at for stamp in stamps.values()), default=None)
+            if request.if_none_match.contains(key) or not_modified_since(last_modified):
+                response = Response(status=304)
+            else:
+                body = page_cache.get(key)
+                if body is None:
+                    response = make_response(f(*args, **kwargs))
+                    if response.status_code != 200 or response.mimetype != 'text/html':
+                        return response
+                    body = response.get_data()
+                    page_cache.set(key, body)
+                response = Response(body, mimetype='text/html')
+            response.set_etag(key)
+            if last_modified:
+                response.last_modified = last_modified
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+
+        return decorated_function3
+
+    return decorator
+
+
+def managed_course_ids():
+    return list(current_user.course_ids)
+
+
+def profile_versions():
+    return [f'user:{current_user.id}', f'progress:user:{current_user.id}'] + \
+        [f'course:{course_id}' for course_id in managed_course_ids() or [current_user.study_course_id]]
 
 
-@app.route('/register', methods=['POST', 'GET'])
+@site.route('/register', methods=['POST', 'GET'])
 def register():
     register_form = RegisterForm()
     if register_form.validate_on_submit():
@@ -112,61 +478,89 @@ def register():
             new_user.date_of_register = date.today().strftime("%B %d, %Y")
             if not register_form.course_code.data:
                 db.session.add(new_user)
+                bump_counter('users')
                 db.session.commit()
-                return redirect(url_for('login'))
+                return redirect(url_for('site.login'))
             else:
                 if Course.query.filter_by(code=register_form.course_code.data).first():
                     founded_course = Course.query.filter_by(code=register_form.course_code.data).first()
                     if not founded_course.belong_to_user_id:
                         db.session.add(new_user)
+                        bump_counter('users')
                         db.session.commit()
                         founded_user = User.query.filter_by(email=register_form.email.data).first()
                         founded_course.belong_to_user_id = founded_user.id
                         db.session.add(founded_course)
                         db.session.commit()
-                        return redirect(url_for('login'))
+                        identity_changed(founded_user.id)
+                        return redirect(url_for('site.login'))
                     else:
                         flash('This Course Is Belonged To Someone Else')
-                        return redirect(url_for('register'))
+                        return redirect(url_for('site.register'))
                 else:
                     flash('Entered Code is Wrong')
-                    return redirect(url_for('register'))
+                    return redirect(url_for('site.register'))
 
         else:
             flash('Your Email already has been registered')
-            return redirect(url_for('login'))
+            return redirect(url_for('site.login'))
     return render_template("register.html", form=register_form)
 
 
-login_manager = LoginManager()
-login_manager.init_app(app)
+identity_cache = identity.IdentityCache()
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
-
-
-@app.route('/login', methods=['POST', 'GET'])
+    user_id = int(user_id)
+    user = identity_cache.get(user_id, changed_at=session.get('identity_changed_at', 0))
+    if user is None:
+        user = load_identity(user_id)
+        if user:
+            identity_cache.set(user)
+    return user
+
+
+def load_identity(user_id):
+    # the user and the ids of the courses they manage in one query
+    row = db.session.query(User.id, User.name, User.email, User.img, User.study_course_id,
+                           func.group_concat(Course.id))\
+        .outerjoin(Course, Course.belong_to_user_id == User.id).filter(User.id == user_id).group_by(User.id).first()
+    if row is None:
+        return None
+    course_ids = sorted(int(course_id) for course_id in row[5].split(',')) if row[5] else []
+    return identity.Identity(*row[:5], course_ids=course_ids)
+
+
+def identity_changed(user_id):
+    identity_cache.invalidate(user_id)
+    if current_user.is_authenticated and current_user.id == user_id:
+        # other workers compare their cached copy with this stamp of the session
+        session['identity_changed_at'] = time.time()
+
+
+@site.route('/login', methods=['POST', 'GET'])
 def login():
     login_form = LoginForm()
     if login_form.validate_on_submit():
         logged_in_user = User.query.filter_by(email=login_form.email.data).first()
         if logged_in_user:
             if check_password_hash(logged_in_user.password, login_form.password.data):
+                logged_in_user = load_identity(logged_in_user.id)
+                identity_cache.set(logged_in_user)
                 login_user(logged_in_user)
-                if logged_in_user.id == 1:
-                    return redirect(url_for('admin'))
-                elif logged_in_user.study_course or logged_in_user.has_courses:
-                    return redirect(url_for('profile'))
+                if logged_in_user.is_admin:
+                    return redirect(url_for('site.admin'))
+                elif logged_in_user.study_course_id or logged_in_user.is_course_manager:
+                    return redirect(url_for('site.profile'))
                 else:
-                    return redirect(url_for('choose_course'))
+                    return redirect(url_for('site.choose_course'))
             else:
                 flash('The Entered Password Is Wrong')
-                return redirect(url_for('login'))
+                return redirect(url_for('site.login'))
         else:
             flash('The Entered Email Is Wrong')
-            return redirect(url_for('login'))
+            return redirect(url_for('site.login'))
     return render_template("login.html", form=login_form)
 
 
@@ -174,15 +568,16 @@ def admin_only(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if current_user.is_authenticated:
-            if current_user.id == 1:
+            if current_user.is_admin:
                 return f(*args, **kwargs)
         return abort(403)
 
     return decorated_function
 
 
-@app.route('/admin')
+@site.route('/admin')
 @admin_only
+@cached_page(lambda: ['courses'])
 def admin():
     all_courses = db.session.query(Course).all()
     user_name = ''
@@ -192,19 +587,58 @@ def admin():
                            all_courses=all_courses)
 
 
-@app.route('/delete_course/<int:course_id>')
+@site.route('/metrics')
+@admin_only
+def show_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@site.route('/delete_course/<int:course_id>')
 @admin_only
 def delete_course(course_id):
-    course_to_delete = Course.query.get(course_id)
+    course_to_delete = Course.query.get_or_404(course_id)
     if course_to_delete.belong_to_user_id:
         flash('This Course Has Owner, It Can Not Be Deleted')
     else:
-        db.session.delete(course_to_delete)
-        db.session.commit()
-    return redirect(url_for('admin'))
+        job_id = job_queue.enqueue('delete_course', {'course_id': course_id}, user_id=current_user.id)
+        return redirect(url_for('site.admin_job', job_id=job_id))
+    return redirect(url_for('site.admin'))
 
 
-@app.route('/course_creation', methods=['POST', 'GET'])
+# the page an admin is sent to after starting a job, it reloads itself until the job is finished
+@site.route('/admin/jobs/<int:job_id>')
+@admin_only
+def admin_job(job_id):
+    job = job_queue.status(job_id)
+    if job is None:
+        abort(404)
+    course_name = None
+    if job['name'] == 'delete_course':
+        course_name = db.session.query(Course.name).filter_by(id=job['payload']['course_id']).scalar()
+    return render_template('admin_job.html', logged_in=current_user.is_authenticated, user_name=current_user.name,
+                           job=job, course_name=course_name)
+
+
+@job_queue.task('delete_course')
+def delete_course_job(job, course_id):
+    course_to_delete = db.session.get(Course, course_id)
+    if course_to_delete is None or course_to_delete.belong_to_user_id:
+        return {'deleted': False}
+    delete_sections([row[0] for row in db.session.query(Section.id).filter_by(belong_to_course_id=course_id)])
+    # its learners have to choose another course, profile() sends them to choose_course
+    learner_ids = [row[0] for row in db.session.query(User.id).filter_by(study_course_id=course_id)]
+    db.session.execute(update(User).where(User.study_course_id == course_id).values(study_course_id=None),
+                       execution_options={'synchronize_session': False})
+    db.session.execute(delete(Course).where(Course.id == course_id),
+                       execution_options={'synchronize_session': False})
+    bump_counter('courses', -1)
+    bump_versions('courses', f'course:{course_id}')
+    db.session.commit()
+    identity_cache.invalidate(*learner_ids)
+    return {'deleted': True}
+
+
+@site.route('/course_creation', methods=['POST', 'GET'])
 @admin_only
 def course_creation():
     user_name = current_user.name
@@ -218,17 +652,22 @@ def course_creation():
         new_course.month = course_form.month.data
         new_course.year = course_form.year.data
         new_course.date_of_creation = date.today().strftime("%B %d, %Y")
+        if course_form.img.data:
+            new_course.img = save_image(course_form.img)
         new_course.name = course_form.language.data + " - " + course_form.level.data + " - " + course_form.month.data \
                           + " - " + course_form.year.data
         db.session.add(new_course)
+        bump_counter('courses')
+        bump_versions('courses')
         db.session.commit()
-        return redirect(url_for('admin'))
+        return redirect(url_for('site.admin'))
     return render_template('course_creation.html', form=course_form, logged_in=current_user.is_authenticated,
                            user_name=user_name)
 
 
-@app.route('/choose_course')
+@site.route('/choose_course')
 @login_required
+@cached_page(lambda: ['courses'])
 def choose_course():
     user_name = current_user.name
     all_courses = db.session.query(Course).all()
@@ -236,125 +675,338 @@ def choose_course():
                            user_name=user_name)
 
 
-@app.route('/add_course/<course_name>')
+@site.route('/add_course/<int:course_id>')
 @login_required
-def add_course(course_name):
-    current_user.study_course = course_name
+def add_course(course_id):
+    Course.query.get_or_404(course_id)
+    User.query.filter_by(id=current_user.id).update({User.study_course_id: course_id})
     db.session.commit()
-    return redirect(url_for('profile'))
+    identity_changed(current_user.id)
+    return redirect(url_for('site.profile'))
 
 
-@app.route('/profile', methods=['POST', 'GET'])
+@site.route('/profile', methods=['POST', 'GET'])
 @login_required
+@cached_page(profile_versions)
 def profile():
     course_name = ''
     user_name = current_user.name
-    if current_user.id == 1:
-        return redirect(url_for('admin'))
+    if current_user.is_admin:
+        return redirect(url_for('site.admin'))
     else:
         search_form = SearchForm()
-        search_list = []
-        allow_to_edit = False
         if search_form.validate_on_submit():
-            all_words = db.session.query(Word).all()
-            if current_user.has_courses:
-                allow_to_edit = True
-            for word in all_words:
-                if search_form.word.data.lower() in word.name.lower() or search_form.word.data.lower() in\
-                        word.meaning.lower():
-                    search_list.append(word)
-            return render_template("search_result.html", search_list=search_list, word=search_form.word.data,
-                                   allow_to_edit=allow_to_edit, logged_in=current_user.is_authenticated,
-                                   user_name=user_name)
-        elif current_user.has_courses:
+            return render_search_result(search_form.word.data)
+        elif current_user.is_course_manager:
             user_role = "course_manager"
-            for course in current_user.has_courses:
-                course_name = course.name
-            course_to_learn = Course.query.filter_by(name=course_name).first()
+            course_to_learn = Course.query.options(selectinload(Course.has_section))\
+                .filter_by(id=current_user.course_ids[-1]).first()
+            course_name = course_to_learn.name
             section_list = []
             for section in course_to_learn.has_section:
                 section_list.append(section)
             return render_template("profile.html", logged_in=current_user.is_authenticated, user_name=user_name,
                                    user_role=user_role, course_name=course_name, section_list=section_list[::-1],
-                                   searchform=search_form)
+                                   searchform=search_form, word_counts=section_word_counts(section_list),
+                                   progress=learner_progress(current_user.id), image_form=ImageForm(),
+                                   user_img=current_user.img)
         else:
-            course_to_learn = Course.query.filter_by(name=current_user.study_course).first()
+            course_to_learn = Course.query.options(selectinload(Course.has_section))\
+                .filter_by(id=current_user.study_course_id).first()
+            if not course_to_learn:
+                return redirect(url_for('site.choose_course'))
             section_list = []
             for section in course_to_learn.has_section:
                 section_list.append(section)
             return render_template("profile.html", logged_in=current_user.is_authenticated, user_name=user_name,
-                                   section_list=section_list[::-1], searchform=search_form)
+                                   section_list=section_list[::-1], searchform=search_form,
+                                   word_counts=section_word_counts(section_list),
+                                   progress=learner_progress(current_user.id), image_form=ImageForm(),
+                                   user_img=current_user.img)
+
+
+@site.route('/profile/image', methods=['POST'])
+@login_required
+def profile_image():
+    image_form = ImageForm()
+    if image_form.validate_on_submit() and image_form.img.data:
+        User.query.filter_by(id=current_user.id).update({User.img: save_image(image_form.img)})
+        bump_versions(f'user:{current_user.id}')
+        db.session.commit()
+        identity_changed(current_user.id)
+    else:
+        for error in image_form.img.errors:
+            flash(error)
+    return redirect(url_for('site.profile'))
+
+
+@site.route('/search')
+@login_required
+def search_word():
+    return render_search_result(request.args.get('q', ''), section_id=request.args.get('section_id', type=int),
+                                course_id=request.args.get('course_id', type=int),
+                                page=request.args.get('page', 1, type=int))
+
+
+# "did you mean" is only worth its lookup when the query found (almost) nothing
+SUGGEST_BELOW = 3
+
+
+def render_search_result(word, section_id=None, course_id=None, page=1):
+    with metrics.timed('search_words'):
+        found_ids, total = search.search_words(db.session, word, section_id=section_id, course_id=course_id,
+                                               page=page)
+    found_words = {found.id: found for found in
+                   Word.query.options(joinedload(Word.belong_to_section)).filter(Word.id.in_(found_ids))}
+    search_list = [found_words[word_id] for word_id in found_ids if word_id in found_words]
+    allow_to_edit = current_user.is_course_manager
+    has_next = page * search.RESULTS_PER_PAGE < total
+    suggestions = []
+    if total < SUGGEST_BELOW and page == 1:
+        with metrics.timed('suggest_words'):
+            suggestions = search.suggest_words(db.session, word)
+    return render_template("search_result.html", search_list=search_list, word=word, allow_to_edit=allow_to_edit,
+                           total=total, page=page, has_next=has_next, section_id=section_id, course_id=course_id,
+                           suggestions=suggestions, too_short=not search.searchable_terms(word),
+                           min_length=search.MIN_TERM_LENGTH, logged_in=current_user.is_authenticated,
+                           user_name=current_user.name)
 
 # +++++++++++++++++++++++++++++++++++++++++++++++++ Learning ++++++++++++++++++++++++++++++++++++++++++++++++++++++
 
 
-word_list = []
-word_name = ''
-word_meaning = ''
-word_description = ''
-word_gender = ''
-word__id = ''
+deck_store = LocalProxy(lambda: current_app.extensions['deck_store'])
+LEARNING_THUMBNAIL_SIZE = 480
+FINISHED_MESSAGE = "You Finished Learning This Section"
+ANSWER_MESSAGES = {'correct': "Correct: {answer}", 'almost': "Almost, watch the spelling: {answer}",
+                   'gender': "Right word, wrong article: {answer}", 'wrong': "Not quite, it is: {answer}"}
 
 
-@app.route('/select_word')
+@site.route('/select_word')
 @login_required
 def select_word():
-    global word_name, word__id, word_meaning, word_gender, word_description
-    word_meaning = ''
-    word_gender = ''
-    word_name = ''
-    word__id = ''
-    word_description = ''
-    if word_list:
-        selected_word = random.choice(word_list)
-        word_name = selected_word.meaning
-        word__id = selected_word.id
-    else:
-        word_name = "You Finished Learning This Section"
-    return redirect(url_for('show_learning'))
+    deck = deck_store.load(current_user.id)
+    if deck:
+        if deck.current and deck.revealed:
+            record_reviews(current_user.id, [(deck.current, False)])
+        deck.draw()
+        deck_store.save(current_user.id, deck)
+    return redirect(url_for('site.show_learning'))
 
 
-@app.route('/show_answer')
+@site.route('/show_answer')
 @login_required
 def show_answer():
-    global word_meaning, word_gender, word_description
-    selected_word = Word.query.get(word__id)
-    word_gender = selected_word.gender
-    word_meaning = selected_word.name
-    word_description = selected_word.description
-    return redirect(url_for('show_learning'))
+    deck = deck_store.load(current_user.id)
+    if deck and deck.current:
+        deck.revealed = True
+        deck_store.save(current_user.id, deck)
+    return redirect(url_for('site.show_learning'))
 
 
-@app.route('/pack_word_list/<int:section_id>')
+@site.route('/pack_word_list/<int:section_id>')
 @login_required
 def pack_word_list(section_id):
-    global word_list
-    word_list = []
-    section = Section.query.get(section_id)
-    for word in section.has_word:
-        word_list.append(word)
-    return redirect(url_for('select_word'))
+    deck = learning.Deck(section_id, due_word_ids(current_user.id, section_id))
+    deck.draw()
+    deck_store.save(current_user.id, deck)
+    return render_learning(deck, section_id=section_id)
+
+
+@site.route('/deck/<int:section_id>')
+@login_required
+def deck_words(section_id):
+    rows = db.session.query(Word.id, Word.meaning, Word.name, Word.gender, Word.description, Word.img)\
+        .filter_by(belong_to_section_id=section_id).order_by(Word.id)
+    response = jsonify(words=[list(row[:5]) + [media_url(row[5], LEARNING_THUMBNAIL_SIZE)] for row in rows])
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+@site.route('/deck/<int:section_id>/progress', methods=['POST'])
+@login_required
+def deck_progress(section_id):
+    progress = request.get_json(silent=True)
+    if not isinstance(progress, dict) or \
+            not all(isinstance(progress.get(key, []), list) for key in ['learned', 'missed']):
+        abort(400)
+    # bool is a subclass of int, but true is no word id
+    learned = [word_id for word_id in progress.get('learned', []) if type(word_id) is int]
+    missed = [word_id for word_id in progress.get('missed', []) if type(word_id) is int]
+    record_reviews(current_user.id, [(word_id, True) for word_id in learned] +
+                   [(word_id, False) for word_id in missed])
+    deck = deck_store.load(current_user.id)
+    if deck and deck.section_id == section_id and learned:
+        deck.remove_ids(learned)
+        deck_store.save(current_user.id, deck)
+    return '', 204
+
+
+@site.route('/check_answer', methods=['POST'])
+@login_required
+def check_answer():
+    # a right answer counts like "I Got it"; a wrong one reveals the word, and "Next" then records the miss
+    deck = deck_store.load(current_user.id)
+    form = AnswerForm()
+    if deck and deck.current and form.validate_on_submit():
+        word = db.session.get(Word, deck.current)
+        result = search.grade_answer(form.answer.data, word.name, word.gender)
+        flash(answer_message(result, word))
+        if result['correct']:
+            record_reviews(current_user.id, [(deck.current, True)])
+            deck.remove_current()
+            deck.draw()
+        else:
+            deck.revealed = True
+        deck_store.save(current_user.id, deck)
+    return redirect(url_for('site.show_learning'))
 
 
-@app.route('/remove_from_list')
+@site.route('/deck/<int:section_id>/answer', methods=['POST'])
+@login_required
+def deck_answer(section_id):
+    # grading only, the browser reports the outcome with the rest of its progress
+    answer = request.get_json(silent=True)
+    if not isinstance(answer, dict) or type(answer.get('word_id')) is not int or \
+            not isinstance(answer.get('answer'), str):
+        abort(400)
+    word = Word.query.filter_by(id=answer['word_id'], belong_to_section_id=section_id).first()
+    if not word:
+        abort(400)
+    result = search.grade_answer(answer['answer'], word.name, word.gender)
+    result['message'] = answer_message(result, word)
+    return jsonify(result)
+
+
+def answer_message(result, word):
+    return ANSWER_MESSAGES[result['grade']].format(answer=' '.join(filter(None, [word.gender, word.name])))
+
+
+@site.route('/remove_from_list')
 @login_required
 def remove_from_list():
-    global word_list
-    word_to_remove = Word.query.get(word__id)
-    if word_list:
-        for word in word_list:
-            if word.id == word_to_remove.id:
-                word_list.remove(word)
-    return redirect(url_for('select_word'))
+    deck = deck_store.load(current_user.id)
+    if deck:
+        if deck.current:
+            record_reviews(current_user.id, [(deck.current, True)])
+        deck.remove_current()
+        deck_store.save(current_user.id, deck)
+    return redirect(url_for('site.select_word'))
 
 
-@app.route('/show_learning')
+@site.route('/show_learning')
 @login_required
 def show_learning():
+    return render_learning(deck_store.load(current_user.id))
+
+
+def render_learning(deck, section_id=None):
     user_name = current_user.name
+    word_name = FINISHED_MESSAGE
+    word__id = word_meaning = word_gender = word_description = word_img = ''
+    selected_word = Word.query.get(deck.current) if deck and deck.current else None
+    if selected_word:
+        word_name = selected_word.meaning
+        word__id = selected_word.id
+        word_img = media_url(selected_word.img, LEARNING_THUMBNAIL_SIZE)
+        if deck.revealed:
+            word_gender = selected_word.gender
+            word_meaning = selected_word.name
+            word_description = selected_word.description
     return render_template("learning.html", logged_in=current_user.is_authenticated, user_name=user_name,
                            word_name=word_name, word_id=word__id, word_meaning=word_meaning, word_gender=word_gender,
-                           word_description=word_description)
+                           word_description=word_description, word_img=word_img, section_id=section_id,
+                           due_ids=list(deck.word_ids) if deck else [], answer_form=AnswerForm())
+
+
+def due_word_ids(user_id, section_id, now=None):
+    # words of the section which are due (one range query on review_user_section_due) plus the never seen ones
+    now = now or datetime.utcnow()
+    due = db.session.query(ReviewState.word_id).filter(ReviewState.user_id == user_id,
+                                                       ReviewState.section_id == section_id,
+                                                       ReviewState.due_at <= now)
+    seen = db.session.query(ReviewState.word_id).filter(ReviewState.user_id == user_id,
+                                                        ReviewState.section_id == section_id)
+    unseen = db.session.query(Word.id).filter(Word.belong_to_section_id == section_id, Word.id.not_in(seen))
+    return [row[0] for row in due.union_all(unseen)]
+
+
+def record_reviews(user_id, outcomes, now=None):
+    # outcomes is a list of (word_id, correct), all of them are written in one transaction
+    if not outcomes:
+        return
+    now = now or datetime.utcnow()
+    word_ids = {word_id for word_id, correct in outcomes}
+    states = {state.word_id: state for state in
+              ReviewState.query.filter(ReviewState.user_id == user_id, ReviewState.word_id.in_(word_ids))}
+    missing = word_ids - states.keys()
+    if missing:
+        for word_id, section_id in db.session.query(Word.id, Word.belong_to_section_id).filter(Word.id.in_(missing)):
+            states[word_id] = ReviewState(user_id=user_id, word_id=word_id, section_id=section_id, box=0)
+            db.session.add(states[word_id])
+    reviews = []
+    for word_id, correct in outcomes:
+        state = states.get(word_id)
+        if state:
+            box = state.box
+            state.box, state.due_at = learning.schedule(state.box, correct, now)
+            reviews.append((word_id, state.section_id, correct, box, state.box, state.reviewed_at is None))
+            state.reviewed_at = now
+    record_progress(user_id, reviews, now)
+    db.session.commit()
+
+
+def record_progress(user_id, reviews, now):
+    # reviews are (word_id, section_id, correct, box before, box after, first review) tuples; they are appended to the
+    # event log and added to the summaries in the caller's transaction
+    if not reviews:
+        return
+    section_ids = {review[1] for review in reviews}
+    course_ids = dict(db.session.query(Section.id, Section.belong_to_course_id).filter(Section.id.in_(section_ids)))
+    db.session.execute(insert(LearningEvent.__table__),
+                       [{'user_id': user_id, 'word_id': word_id, 'section_id': section_id,
+                         'course_id': course_ids.get(section_id), 'correct': correct, 'created_at': now}
+                        for word_id, section_id, correct, before, after, first in reviews])
+    sections = {}
+    words = {}
+    for word_id, section_id, correct, before, after, first in reviews:
+        summary = sections.setdefault(section_id, {'user_id': user_id, 'section_id': section_id, 'seen': 0,
+                                                   'mastered': 0, 'learned': 0, 'missed': 0, 'reviewed_at': now})
+        summary['seen'] += first
+        summary['mastered'] += (after >= learning.MASTERED_BOX) - (before >= learning.MASTERED_BOX)
+        summary['learned' if correct else 'missed'] += 1
+        course_id = course_ids.get(section_id)
+        if course_id:
+            word = words.setdefault(word_id, {'course_id': course_id, 'word_id': word_id, 'learned': 0, 'missed': 0})
+            word['learned' if correct else 'missed'] += 1
+    for word in words.values():
+        word['difficulty'] = word_difficulty(word['learned'], word['missed'])
+    sections.pop(None, None)
+    if sections:
+        table = SectionProgress.__table__
+        statement = sqlite_insert(table)
+        totals = {name: table.c[name] + statement.excluded[name] for name in ['seen', 'mastered', 'learned', 'missed']}
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=['user_id', 'section_id'], set_=totals | {'reviewed_at': statement.excluded.reviewed_at}),
+            list(sections.values()))
+    if words:
+        table = WordProgress.__table__
+        statement = sqlite_insert(table)
+        learned = table.c.learned + statement.excluded.learned
+        missed = table.c.missed + statement.excluded.missed
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=['course_id', 'word_id'],
+            set_={'learned': learned, 'missed': missed, 'difficulty': word_difficulty(learned, missed)}),
+            list(words.values()))
+    bump_versions(f'progress:user:{user_id}',
+                  *[f'progress:course:{course_id}' for course_id in set(course_ids.values()) if course_id])
+
+
+def word_difficulty(learned, missed):
+    # the share of misses, smoothed so that one miss doesn't put a word at the top of the hardest ones; works on
+    # numbers and on column expressions alike
+    return (missed + 1.0) / (learned + missed + 2.0)
 
 
 # +++++++++++++++++++++++++++++++++++++++++++++++++ End of Learning ++++++++++++++++++++++++++++++++++++++++++++++++
@@ -364,63 +1016,230 @@ def course_manager_only(f):
     @wraps(f)
     def decorated_function2(*args, **kwargs):
         if current_user.is_authenticated:
-            if current_user.has_courses:
+            if current_user.is_course_manager:
                 return f(*args, **kwargs)
         return abort(403)
 
     return decorated_function2
 
 
-@app.route('/section_manage', methods=['POST', 'GET'])
+@site.route('/section_manage', methods=['POST', 'GET'])
 @course_manager_only
+@cached_page(lambda: [f'{kind}:{course_id}' for course_id in managed_course_ids()
+                      for kind in ['course', 'progress:course']])
 def section_manage():
     user_name = ''
     section_list = []
     section_form = SectionForm()
     if current_user.is_authenticated:
-        for course in current_user.has_courses:
+        managed_courses = Course.query.options(selectinload(Course.has_section))\
+            .filter_by(belong_to_user_id=current_user.id)
+        for course in managed_courses:
             for section in course.has_section:
                 section_list.append(section)
         user_name = current_user.name
         if section_form.validate_on_submit():
             new_section = Section()
             new_section.name = section_form.name.data
-            for course in current_user.has_courses:
-                new_section.belong_to_course_id = course.id
+            if section_form.img.data:
+                new_section.img = save_image(section_form.img)
+            new_section.belong_to_course_id = current_user.course_ids[-1]
             db.session.add(new_section)
+            bump_versions(f'course:{new_section.belong_to_course_id}')
             db.session.commit()
-            new_added_section = Section.query.filter_by(name=section_form.name.data).first()
-            section_id = new_added_section.id
-            return redirect(url_for('word_manage', section_id=section_id))
+            section_id = new_section.id
+            return redirect(url_for('site.word_manage', section_id=section_id))
+    section_progress, hardest_words = course_progress(section_list, managed_course_ids())
     return render_template("section_manage.html", user_name=user_name, logged_in=current_user.is_authenticated,
-                           form=section_form, section_list=section_list[::-1])
-
-
-@app.template_global('number_of_words')
-def number_of_words(sec_id):
-    referred_section = Section.query.get(sec_id)
-    return len(referred_section.has_word)
-
-
-@app.route("/delete_section/<int:section_id>")
+                           form=section_form, section_list=section_list[::-1],
+                           word_counts=section_word_counts(section_list), section_progress=section_progress,
+                           hardest_words=hardest_words)
+
+
+def section_word_counts(section_list):
+    # one GROUP BY for the whole listing instead of one COUNT per section
+    section_ids = [section.id for section in section_list]
+    if not section_ids:
+        return {}
+    rows = db.session.query(Word.belong_to_section_id, func.count(Word.id))\
+        .filter(Word.belong_to_section_id.in_(section_ids)).group_by(Word.belong_to_section_id)
+    with metrics.timed('section_word_counts'):
+        return dict(rows.all())
+
+
+def review_counts(word_ids):
+    # (user_id, section_id, seen, mastered) of the learners who reviewed the words
+    mastered = func.sum(case((ReviewState.box >= learning.MASTERED_BOX, 1), else_=0))
+    return db.session.query(ReviewState.user_id, ReviewState.section_id, func.count(), mastered)\
+        .filter(ReviewState.word_id.in_(word_ids), ReviewState.section_id.isnot(None))\
+        .group_by(ReviewState.user_id, ReviewState.section_id).all()
+
+
+def forget_word_progress(word_ids):
+    # the learners who reviewed the words no longer have them seen or mastered in their section summaries; the word
+    # summaries go with the words through the foreign key
+    rows = review_counts(word_ids)
+    if not rows:
+        return
+    table = SectionProgress.__table__
+    db.session.execute(update(table).where(table.c.user_id == bindparam('b_user_id'),
+                                           table.c.section_id == bindparam('b_section_id'))
+                       .values(seen=table.c.seen - bindparam('b_seen'),
+                               mastered=table.c.mastered - bindparam('b_mastered')),
+                       [{'b_user_id': user_id, 'b_section_id': section_id, 'b_seen': seen, 'b_mastered': mastered}
+                        for user_id, section_id, seen, mastered in rows])
+    bump_versions(*[f'progress:user:{user_id}' for user_id in {row[0] for row in rows}])
+
+
+def move_word_reviews(word_ids):
+    # review states keep a copy of their word's section, and word summaries one of its course; they and the section
+    # summaries follow words which were moved to another section
+    if not word_ids:
+        return
+    forget_word_progress(word_ids)
+    course_ids = {row[0] for row in db.session.query(WordProgress.course_id)
+                  .filter(WordProgress.word_id.in_(word_ids))}
+    course_ids |= {row[0] for row in db.session.query(Section.belong_to_course_id).join(Word.belong_to_section)
+                   .filter(Word.id.in_(word_ids))}
+    bump_versions(*[f'progress:course:{course_id}' for course_id in course_ids])
+    db.session.execute(update(WordProgress).where(WordProgress.word_id.in_(word_ids))
+                       .values(course_id=select(Section.belong_to_course_id).join(Word.belong_to_section)
+                               .where(Word.id == WordProgress.word_id).scalar_subquery()),
+                       execution_options={'synchronize_session': False})
+    db.session.execute(update(ReviewState).where(ReviewState.word_id.in_(word_ids))
+                       .values(section_id=select(Word.belong_to_section_id).where(Word.id == ReviewState.word_id)
+                               .scalar_subquery()),
+                       execution_options={'synchronize_session': False})
+    rows = review_counts(word_ids)
+    if not rows:
+        return
+    table = SectionProgress.__table__
+    statement = sqlite_insert(table)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['user_id', 'section_id'],
+        set_={name: table.c[name] + statement.excluded[name] for name in ['seen', 'mastered']}),
+        [{'user_id': user_id, 'section_id': section_id, 'seen': seen, 'mastered': mastered, 'learned': 0,
+          'missed': 0} for user_id, section_id, seen, mastered in rows])
+
+
+def learner_progress(user_id):
+    # the user's summary row of every section they have practised, read by primary key
+    with metrics.timed('learner_progress'):
+        return {progress.section_id: progress for progress in SectionProgress.query.filter_by(user_id=user_id)}
+
+
+def course_progress(section_list, course_ids, hardest=10):
+    """Learners and mastered words per section, from the summaries, and the words most often missed."""
+    section_ids = [section.id for section in section_list]
+    if not section_ids:
+        return {}, []
+    with metrics.timed('course_progress'):
+        sections = {row.section_id: row for row in
+                    db.session.query(SectionProgress.section_id, func.count().label('learners'),
+                                     func.sum(SectionProgress.mastered).label('mastered'),
+                                     func.sum(SectionProgress.learned).label('learned'),
+                                     func.sum(SectionProgress.missed).label('missed'))
+                    .filter(SectionProgress.section_id.in_(section_ids)).group_by(SectionProgress.section_id)}
+        words = db.session.query(Word, WordProgress).join(WordProgress, WordProgress.word_id == Word.id)\
+            .filter(WordProgress.course_id.in_(course_ids)).order_by(WordProgress.difficulty.desc())\
+            .limit(hardest).all()
+    return sections, words
+
+
+@site.route("/delete_section/<int:section_id>")
 @course_manager_only
 def delete_section(section_id):
-    section_to_delete = Section.query.get(section_id)
-    for words in section_to_delete.has_word:
-        word_to_delete = Word.query.get(words.id)
-        db.session.delete(word_to_delete)
-        db.session.commit()
-    db.session.delete(section_to_delete)
+    delete_sections([section_id])
     db.session.commit()
-    return redirect(url_for('section_manage'))
+    return redirect(url_for('site.section_manage'))
 
 
-@app.route('/word_manage/section/<section_id>', methods=['POST', 'GET'])
+def delete_sections(section_ids):
+    # a few set based statements in the caller's transaction, whatever the number of words in the sections
+    if not section_ids:
+        return
+    bump_section_versions(*section_ids)
+    search.unindex_sections(db.session, section_ids)
+    db.session.execute(delete(ReviewState).where(ReviewState.section_id.in_(section_ids)),
+                       execution_options={'synchronize_session': False})
+    deleted_words = db.session.execute(delete(Word).where(Word.belong_to_section_id.in_(section_ids)),
+                                       execution_options={'synchronize_session': False}).rowcount
+    db.session.execute(delete(Section).where(Section.id.in_(section_ids)),
+                       execution_options={'synchronize_session': False})
+    bump_counter('words', -deleted_words)
+
+
+@site.route('/move_sections', methods=['POST', 'GET'])
+@admin_only
+def move_sections():
+    move_form = MoveSectionsForm()
+    all_sections = db.session.query(Section.id, Section.name, Course.name).join(Section.belong_to_course)\
+        .order_by(Course.id, Section.id)
+    move_form.sections.choices = [(section_id, f"{course_name} | {section_name}")
+                                  for section_id, section_name, course_name in all_sections]
+    move_form.course.choices = [(course_id, course_name) for course_id, course_name in
+                                db.session.query(Course.id, Course.name).order_by(Course.id)]
+    if move_form.validate_on_submit():
+        if move_form.action.data == 'move':
+            move_sections_to(move_form.sections.data, move_form.course.data)
+            db.session.commit()
+        else:
+            job_id = job_queue.enqueue('copy_sections', {'section_ids': move_form.sections.data,
+                                                         'course_id': move_form.course.data}, user_id=current_user.id)
+            return redirect(url_for('site.admin_job', job_id=job_id))
+        return redirect(url_for('site.admin'))
+    return render_template("move_sections.html", form=move_form, logged_in=current_user.is_authenticated,
+                           user_name=current_user.name)
+
+
+def move_sections_to(section_ids, course_id):
+    """Move sections to another course, used by the admin form and PATCH /api/sections; doesn't commit."""
+    bump_section_versions(*section_ids)
+    course_ids = {row[0] for row in db.session.query(Section.belong_to_course_id)
+                  .filter(Section.id.in_(section_ids))} | {course_id}
+    bump_versions(*[f'course:{affected}' for affected in course_ids],
+                  *[f'progress:course:{affected}' for affected in course_ids])
+    db.session.execute(update(Section).where(Section.id.in_(section_ids)).values(belong_to_course_id=course_id),
+                       execution_options={'synchronize_session': False})
+    # the words' summaries go with them to the new course
+    db.session.execute(update(WordProgress).where(WordProgress.word_id.in_(
+        select(Word.id).where(Word.belong_to_section_id.in_(section_ids)))).values(course_id=course_id),
+                       execution_options={'synchronize_session': False})
+
+
+# copying twice would make two copies, so a failed copy is not retried
+@job_queue.task('copy_sections', max_attempts=1)
+def copy_sections_job(job, section_ids, course_id):
+    bump_versions(f'course:{course_id}')
+    copy_sections(section_ids, course_id, progress=job.progress)
+    db.session.commit()
+    return {'copied': len(section_ids)}
+
+
+def copy_sections(section_ids, course_id, progress=None):
+    word_columns = [Word.name, Word.meaning, Word.gender, Word.description, Word.img]
+    sections = Section.query.filter(Section.id.in_(section_ids)).order_by(Section.id).all()
+    for number, section in enumerate(sections):
+        if progress:
+            progress(number, len(sections))
+        new_section = Section(name=section.name, img=section.img, extra=section.extra, belong_to_course_id=course_id)
+        db.session.add(new_section)
+        db.session.flush()
+        copied_words = db.session.execute(
+            insert(Word).from_select([column.key for column in word_columns] + ['belong_to_section_id'],
+                                     select(*word_columns, literal(new_section.id))
+                                     .where(Word.belong_to_section_id == section.id).order_by(Word.id))).rowcount
+        search.index_section(db.session, new_section.id)
+        bump_counter('words', copied_words)
+
+
+@site.route('/word_manage/section/<section_id>', methods=['POST', 'GET'])
 @course_manager_only
+@cached_page(lambda section_id: [f'section:{section_id}'])
 def word_manage(section_id):
     word_form = WordForm()
     user_name = ''
-    section = Section.query.filter_by(id=int(section_id)).first()
+    section = Section.query.options(selectinload(Section.has_word)).filter_by(id=int(section_id)).first()
     word_list2 = []
     for words in section.has_word:
         word_list2.append(words)
@@ -435,24 +1254,169 @@ def word_manage(section_id):
                 new_word.gender = word_form.gender.data
             if word_form.description:
                 new_word.description = word_form.description.data
+            if word_form.img.data:
+                new_word.img = save_image(word_form.img)
             new_word.belong_to_section_id = section_id
             db.session.add(new_word)
+            db.session.flush()
+            search.index_word(db.session, new_word)
+            bump_counter('words')
+            bump_section_versions(int(section_id))
             db.session.commit()
-            return redirect(url_for('word_manage', section_id=section_id))
+            return redirect(url_for('site.word_manage', section_id=section_id))
     return render_template("word_manage.html", user_name=user_name, logged_in=current_user.is_authenticated,
                            form=word_form, section_name=section_name, word_list=word_list2, section_id=section_id)
 
 
-@app.route("/delete_word/<int:section_id>/<int:word_id>")
+@site.route('/import_words/section/<int:section_id>', methods=['POST', 'GET'])
+@course_manager_only
+def import_words(section_id):
+    section = Section.query.get_or_404(section_id)
+    # like the API, managers only import into their own courses
+    if not current_user.is_admin and section.belong_to_course_id not in current_user.course_ids:
+        abort(403)
+    import_form = ImportWordsForm()
+    if import_form.validate_on_submit():
+        # the upload is kept in the instance folder until the import job has read it
+        uploaded_file = import_form.file.data
+        directory = os.path.join(current_app.instance_path, 'uploads')
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{secrets.token_hex(16)}-{secure_filename(uploaded_file.filename)}")
+        uploaded_file.save(path)
+        job_id = job_queue.enqueue('import_words', {'section_id': section_id, 'path': path,
+                                                    'filename': uploaded_file.filename}, user_id=current_user.id)
+        return redirect(url_for('site.import_words', section_id=section_id, job_id=job_id))
+    job = None
+    job_id = request.args.get('job_id', type=int)
+    if job_id:
+        job = job_queue.status(job_id)
+        if job is None or job['user_id'] != current_user.id:
+            abort(404)
+    return render_template("import_words.html", user_name=current_user.name, logged_in=current_user.is_authenticated,
+                           form=import_form, section_name=section.name, section_id=section_id, job=job,
+                           report=job and job['result'])
+
+
+# batches which went in before a failure are skipped as duplicates by the retry
+@job_queue.task('import_words', concurrency=2, max_attempts=2)
+def import_words_job(job, section_id, path, filename):
+    finished = False
+    try:
+        with open(path, 'rb') as stream:
+            report = import_word_file(section_id, stream, filename,
+                                      progress=lambda report: job.progress(report['imported'],
+                                                                           message=f"{report['imported']} imported"))
+        finished = True
+        return report
+    finally:
+        if finished or job.final:
+            os.remove(path)
+
+
+def import_word_file(section_id, stream, filename, progress=None):
+    report = {'imported': 0, 'duplicates': 0, 'errors': [], 'error_count': 0}
+    batch = []
+
+    def add_error(line, message):
+        report['error_count'] += 1
+        if len(report['errors']) < vocabulary.MAX_REPORTED_ERRORS:
+            report['errors'].append((line, message))
+
+    try:
+        for line, word, error in vocabulary.parse_word_rows(stream, filename):
+            if error:
+                add_error(line, error)
+                continue
+            batch.append(word)
+            if len(batch) == vocabulary.IMPORT_BATCH_SIZE:
+                insert_word_batch(section_id, batch, report)
+                batch = []
+                if progress:
+                    progress(report)
+    except (UnicodeDecodeError, csv.Error) as error:
+        add_error('-', f"The file could not be read any further: {error}")
+    if batch:
+        insert_word_batch(section_id, batch, report)
+        if progress:
+            progress(report)
+    return report
+
+
+def insert_word_batch(section_id, batch, report):
+    # earlier batches are already committed, so checking the batch against the section also catches duplicates
+    # inside the file without keeping the whole file in memory
+    known = set(db.session.query(Word.name, Word.meaning)
+                .filter(Word.belong_to_section_id == section_id, Word.name.in_({word['name'] for word in batch})))
+    rows = []
+    for word in batch:
+        if (word['name'], word['meaning']) in known:
+            report['duplicates'] += 1
+            continue
+        known.add((word['name'], word['meaning']))
+        word['belong_to_section_id'] = section_id
+        rows.append(word)
+    if not rows:
+        return []
+    db.session.execute(insert(Word), rows)
+    # sqlite has a single writer, so the newest rows of the section are the ones just inserted
+    inserted = db.session.query(Word.id, Word.name, Word.meaning, Word.description)\
+        .filter_by(belong_to_section_id=section_id).order_by(Word.id.desc()).limit(len(rows)).all()
+    search.insert_rows(db.session, [search.index_row(*row, section_id) for row in inserted])
+    bump_counter('words', len(rows))
+    bump_section_versions(section_id)
+    db.session.commit()
+    report['imported'] += len(rows)
+    return [row[0] for row in reversed(inserted)]
+
+
+@site.route('/export/section/<int:section_id>.<export_format>')
+@login_required
+def export_section(section_id, export_format):
+    section = Section.query.get_or_404(section_id)
+    return export_response(Section.id == section_id, section.name, export_format)
+
+
+@site.route('/export/course/<int:course_id>.<export_format>')
+@login_required
+def export_course(course_id, export_format):
+    course = Course.query.get_or_404(course_id)
+    return export_response(Section.belong_to_course_id == course_id, course.name, export_format)
+
+
+def export_response(condition, name, export_format):
+    if export_format not in vocabulary.EXPORT_FORMATS:
+        abort(404)
+    mimetype, extension = vocabulary.EXPORT_FORMATS[export_format]
+    rows = db.session.execute(
+        select(Section.name, Word.name, Word.meaning, Word.gender, Word.description)
+        .join(Word.belong_to_section).where(condition).order_by(Section.id, Word.id)
+        .execution_options(yield_per=1000))
+    chunks = vocabulary.export_chunks(rows, export_format)
+    filename = (secure_filename(name) or 'vocabulary') + '.' + extension
+    if request.args.get('gzip'):
+        chunks = vocabulary.gzip_chunks(chunks)
+        mimetype = 'application/gzip'
+        filename += '.gz'
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@site.route("/delete_word/<int:section_id>/<int:word_id>")
 @course_manager_only
 def delete_word(section_id, word_id):
     word_to_delete = Word.query.get(word_id)
+    search.unindex_words(db.session, [word_id])
+    forget_word_progress([word_id])
+    ReviewState.query.filter_by(word_id=word_id).delete(synchronize_session=False)
+    bump_counter('words', -1)
+    bump_section_versions(section_id)
     db.session.delete(word_to_delete)
     db.session.commit()
-    return redirect(url_for('word_manage', section_id=section_id))
+    return redirect(url_for('site.word_manage', section_id=section_id))
 
 
-@app.route("/edit_word/<int:section_id>/<int:word_id>", methods=['POST', 'GET'])
+@site.route("/edit_word/<int:section_id>/<int:word_id>", methods=['POST', 'GET'])
 @course_manager_only
 def edit_word(section_id, word_id):
     word_to_edit = Word.query.get(word_id)
@@ -468,19 +1432,325 @@ def edit_word(section_id, word_id):
         word_to_edit.meaning = word_edit_form.meaning.data
         word_to_edit.gender = word_edit_form.gender.data
         word_to_edit.description = word_edit_form.description.data
+        if word_edit_form.img.data:
+            word_to_edit.img = save_image(word_edit_form.img)
+        search.index_word(db.session, word_to_edit)
+        bump_section_versions(word_to_edit.belong_to_section_id)
         db.session.commit()
-        return redirect(url_for('word_manage', section_id=section_id))
+        return redirect(url_for('site.word_manage', section_id=section_id))
     return render_template('edit_word.html', form=word_edit_form, logged_in=current_user.is_authenticated,
-                           section_id=section_id, user_name=user_name)
+                           section_id=section_id, user_name=user_name, word_img=word_to_edit.img)
+
+
+# ----------------------------------------------- JSON API ------------------------------------------
+# /api/courses, /api/sections and /api/words. Lists are paged by primary key (?after=<last id>&limit=), so every
+# page costs one index range scan, and ?fields=id,name selects the columns. Rows go to json as plain tuples without
+# building ORM objects. POST creates and PATCH updates a batch (a json list) of items in one request.
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
+API_MAX_BATCH = 1000
+API_RESOURCES = {
+    'courses': (Course, {'id': 'id', 'name': 'name', 'language': 'language', 'level': 'level', 'teacher': 'teacher',
+                         'month': 'month', 'year': 'year', 'date_of_creation': 'date_of_creation',
+                         'owner_id': 'belong_to_user_id'}),
+    'sections': (Section, {'id': 'id', 'name': 'name', 'course_id': 'belong_to_course_id'}),
+    'words': (Word, {'id': 'id', 'name': 'name', 'meaning': 'meaning', 'gender': 'gender',
+                     'description': 'description', 'section_id': 'belong_to_section_id'}),
+}
+API_FILTERS = {'sections': 'course_id', 'words': 'section_id'}
+API_WRITABLE = {'courses': ['language', 'level', 'teacher', 'month', 'year'],
+                'sections': ['name', 'course_id'],
+                'words': ['name', 'meaning', 'gender', 'description', 'section_id']}
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+@api.errorhandler(ApiError)
+def api_error(error):
+    response = jsonify(error=str(error))
+    response.status_code = error.status
+    return response
+
+
+def api_resource(resource):
+    if resource not in API_RESOURCES:
+        raise ApiError(f"Unknown resource {resource}", 404)
+    return API_RESOURCES[resource]
+
+
+def api_fields(fields):
+    selected = request.args.get('fields')
+    if not selected:
+        return list(fields)
+    selected = selected.split(',')
+    unknown = [name for name in selected if name not in fields]
+    if unknown:
+        raise ApiError(f"Unknown fields: {', '.join(unknown)}")
+    return selected
+
+
+@api.route('/<resource>')
+@login_required
+def api_list(resource):
+    model, fields = api_resource(resource)
+    selected = api_fields(fields)
+    limit = max(1, min(request.args.get('limit', API_PAGE_SIZE, type=int), API_MAX_PAGE_SIZE))
+    query = select(model.id, *[getattr(model, fields[name]) for name in selected])\
+        .where(model.id > request.args.get('after', 0, type=int))
+    filter_name = API_FILTERS.get(resource)
+    if filter_name and request.args.get(filter_name, type=int) is not None:
+        query = query.where(getattr(model, fields[filter_name]) == request.args.get(filter_name, type=int))
+    rows = db.session.execute(query.order_by(model.id).limit(limit + 1)).all()
+    return jsonify(items=[dict(zip(selected, row[1:])) for row in rows[:limit]],
+                   next=rows[limit - 1][0] if len(rows) > limit else None)
+
+
+@api.route('/<resource>/<int:item_id>')
+@login_required
+def api_item(resource, item_id):
+    model, fields = api_resource(resource)
+    selected = api_fields(fields)
+    row = db.session.execute(select(*[getattr(model, fields[name]) for name in selected])
+                             .where(model.id == item_id)).first()
+    if row is None:
+        raise ApiError(f"No {resource} with id {item_id}", 404)
+    return jsonify(dict(zip(selected, row)))
+
+
+def api_batch(resource, updating):
+    body = request.get_json(silent=True)
+    items = body if isinstance(body, list) else [body]
+    if not items or len(items) > API_MAX_BATCH or not all(isinstance(item, dict) for item in items):
+        raise ApiError(f"Send a json object or a list of up to {API_MAX_BATCH} objects")
+    model, fields = api_resource(resource)
+    writable = API_WRITABLE[resource] + (['id'] if updating else [])
+    rows = []
+    for number, item in enumerate(items):
+        unknown = [name for name in item if name not in writable]
+        if unknown:
+            raise ApiError(f"Item {number}: fields {', '.join(unknown)} can not be written")
+        if updating and not isinstance(item.get('id'), int):
+            raise ApiError(f"Item {number}: id is missing")
+        rows.append({fields[name]: value for name, value in item.items()})
+    return rows
+
+
+def api_check_admin():
+    if not current_user.is_admin:
+        raise ApiError("Only the admin can change courses", 403)
+
+
+def api_check_courses(course_ids):
+    # the admin may write everywhere, course managers only into their own courses
+    if not current_user.is_admin and not set(course_ids) <= set(managed_course_ids()):
+        raise ApiError("You can only change your own courses", 403)
+    if db.session.query(func.count(Course.id)).filter(Course.id.in_(course_ids)).scalar() != len(set(course_ids)):
+        raise ApiError("Unknown course id")
+
+
+def api_check_sections(section_ids):
+    course_ids = dict(db.session.query(Section.id, Section.belong_to_course_id).filter(Section.id.in_(section_ids)))
+    if len(course_ids) != len(set(section_ids)):
+        raise ApiError("Unknown section id")
+    api_check_courses(set(course_ids.values()))
+
+
+def api_validate(resource, rows, partial):
+    names = {column: name for name, column in API_RESOURCES[resource][1].items()}
+    for number, row in enumerate(rows):
+        for column, value in row.items():
+            if column == 'id' or column.startswith('belong_to_'):
+                if not isinstance(value, int) or isinstance(value, bool):
+                    raise ApiError(f"Item {number}: {names[column]} must be a number")
+            elif value is not None and not isinstance(value, str):
+                raise ApiError(f"Item {number}: {names[column]} must be a string")
+        if resource == 'words':
+            error = vocabulary.validate_word(row, partial=partial)
+            if not partial and not row.get('belong_to_section_id'):
+                error = "section_id is missing"
+        elif resource == 'sections':
+            error = None if (partial and 'name' not in row) or row.get('name') else "name is missing"
+            if not partial and not row.get('belong_to_course_id'):
+                error = "course_id is missing"
+        else:
+            missing = [name for name in API_WRITABLE['courses'] if (not partial or name in row) and not row.get(name)]
+            error = f"{', '.join(missing)} missing" if missing else None
+        if error:
+            raise ApiError(f"Item {number}: {error}")
+
+
+@api.route('/<resource>', methods=['POST'])
+@login_required
+def api_create(resource):
+    rows = api_batch(resource, updating=False)
+    api_validate(resource, rows, partial=False)
+    if resource == 'words':
+        api_check_sections({row['belong_to_section_id'] for row in rows})
+        report = {'imported': 0, 'duplicates': 0}
+        ids = []
+        for section_id in sorted({row['belong_to_section_id'] for row in rows}):
+            batch = [dict({'gender': '', 'description': ''}, **row) for row in rows
+                     if row['belong_to_section_id'] == section_id]
+            ids += insert_word_batch(section_id, batch, report)
+        return jsonify(ids=ids, duplicates=report['duplicates']), 201
+    if resource == 'sections':
+        api_check_courses({row['belong_to_course_id'] for row in rows})
+        new_items = [Section(**row) for row in rows]
+        bump_versions(*{f"course:{row['belong_to_course_id']}" for row in rows})
+    else:
+        api_check_admin()
+        new_items = [Course(**row, code=''.join(random.choices(string.ascii_uppercase, k=20)),
+                            date_of_creation=date.today().strftime("%B %d, %Y"),
+                            name=" - ".join(row[name] for name in ['language', 'level', 'month', 'year']))
+                     for row in rows]
+        bump_counter('courses', len(rows))
+        bump_versions('courses')
+    db.session.add_all(new_items)
+    db.session.commit()
+    return jsonify(ids=[new_item.id for new_item in new_items]), 201
+
+
+@api.route('/<resource>', methods=['PATCH'])
+@login_required
+def api_update(resource):
+    rows = api_batch(resource, updating=True)
+    api_validate(resource, rows, partial=True)
+    model, fields = api_resource(resource)
+    ids = [row['id'] for row in rows]
+    if db.session.query(func.count(model.id)).filter(model.id.in_(ids)).scalar() != len(set(ids)):
+        raise ApiError(f"Unknown {resource} id")
+    if resource == 'words':
+        old_sections = dict(db.session.query(Word.id, Word.belong_to_section_id).filter(Word.id.in_(ids)))
+        section_ids = set(old_sections.values())
+        moved_to = {row['belong_to_section_id'] for row in rows if 'belong_to_section_id' in row}
+        api_check_sections(section_ids | moved_to)
+        bump_section_versions(*section_ids)
+    elif resource == 'sections':
+        old_courses = dict(db.session.query(Section.id, Section.belong_to_course_id).filter(Section.id.in_(ids)))
+        moves = {}
+        for row in rows:
+            if row.get('belong_to_course_id', old_courses[row['id']]) != old_courses[row['id']]:
+                moves.setdefault(row['belong_to_course_id'], []).append(row['id'])
+        api_check_courses(set(old_courses.values()) | set(moves))
+        bump_section_versions(*ids)
+        for course_id, section_ids in moves.items():
+            move_sections_to(section_ids, course_id)
+    else:
+        api_check_admin()
+        bump_versions('courses', *[f'course:{course_id}' for course_id in ids])
+    db.session.execute(update(model), rows)
+    if resource == 'words':
+        search.reindex_words(db.session, ids)
+        move_word_reviews([row['id'] for row in rows if row.get('belong_to_section_id', old_sections[row['id']])
+                           != old_sections[row['id']]])
+        bump_section_versions(*moved_to)
+    elif resource == 'sections':
+        bump_section_versions(*ids)
+    db.session.commit()
+    return jsonify(updated=len(rows))
 
 
-@app.route('/logout')
+@site.route('/logout')
 def logout():
     logout_user()
-    return redirect(url_for('index'))
+    return redirect(url_for('site.index'))
+
+
+# ----------------------------------------------- Application factory ------------------------------------------
+# Every setting comes from the environment and create_app(config) overrides them, which is what scripts and tests do.
+# The one time work (schema upgrade, search index check) happens in create_app(), so a server which loads the app
+# before forking its workers (see gunicorn.conf.py) does it once and not once per worker.
+def environment_config(instance_path):
+    return {
+        # must be the same in every worker process, or a session signed by one is rejected by the others
+        'SECRET_KEY': os.environ.get('SECRET_KEY'),
+        'SQLALCHEMY_DATABASE_URI': os.environ.get('DATABASE_URL', 'sqlite:///deutsch.db'),
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        # a worker needs a connection per thread
+        'SQLALCHEMY_ENGINE_OPTIONS': {'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+                                      'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+                                      'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 15)),
+                                      'connect_args': {'timeout': 15}},
+        'MAX_CONTENT_LENGTH': 64 * 1024 * 1024,
+        'LEARNING_SESSION_STORE': os.environ.get('LEARNING_SESSION_STORE', 'sqlite'),
+        'PAGE_CACHE': os.environ.get('PAGE_CACHE', 'memory'),
+        'MEDIA_FOLDER': os.environ.get('MEDIA_FOLDER', os.path.join(instance_path, 'media')),
+        'MEDIA_WORKERS': int(os.environ.get('MEDIA_WORKERS', 2)),
+        'SLOW_REQUEST_SECONDS': float(os.environ.get('SLOW_REQUEST_SECONDS', 1.0)),
+        # shared by the worker processes so /metrics reports all of them, see metrics.py
+        'METRICS_FOLDER': os.environ.get('METRICS_FOLDER'),
+        'JOB_WORKERS': int(os.environ.get('JOB_WORKERS', 2)),
+    }
+
+
+def in_memory_database(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def instance_secret_key(instance_path):
+    # without SECRET_KEY in the environment the first process to start makes one and every later one reads it
+    path = os.path.join(instance_path, 'secret_key')
+    if not os.path.exists(path):
+        descriptor, temporary_path = tempfile.mkstemp(dir=instance_path)
+        with os.fdopen(descriptor, 'w') as key_file:
+            key_file.write(secrets.token_hex(32))
+        try:
+            os.link(temporary_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temporary_path)
+    with open(path) as key_file:
+        return key_file.read().strip()
+
+
+def create_app(config=None):
+    app = Flask(__name__)
+    os.makedirs(app.instance_path, exist_ok=True)
+    app.config.update(environment_config(app.instance_path))
+    app.config.update(config or {})
+    if in_memory_database(app.config['SQLALCHEMY_DATABASE_URI']):
+        # Flask-SQLAlchemy shares one connection (StaticPool) for those, which takes no pool settings
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {key: value for key, value in
+                                                   app.config['SQLALCHEMY_ENGINE_OPTIONS'].items()
+                                                   if key not in ('pool_size', 'max_overflow', 'pool_timeout')}
+    if not app.config['SECRET_KEY']:
+        app.config['SECRET_KEY'] = instance_secret_key(app.instance_path)
+    Bootstrap(app)
+    db.init_app(app)
+    login_manager.init_app(app)
+    app.register_blueprint(site)
+    app.register_blueprint(api)
+    app.view_functions['static'] = static_file
+    before_render_template.connect(start_template_timer, app)
+    template_rendered.connect(stop_template_timer, app)
+    app.extensions['asset_manifest'] = assets.load_manifest(app.static_folder)
+    app.extensions['page_cache'] = caching.create_cache(app.config['PAGE_CACHE'],
+                                                        directory=os.path.join(app.instance_path, 'page_cache'))
+    app.extensions['deck_store'] = learning.create_store(app.config['LEARNING_SESSION_STORE'],
+                                                         path=os.path.join(app.instance_path, 'learning_sessions.db'))
+    metrics.configure(app.config['METRICS_FOLDER'])
+    job_queue.configure(os.path.join(app.instance_path, 'jobs.db'), workers=app.config['JOB_WORKERS'],
+                        context=app.app_context)
+    with app.app_context():
+        event.listen(db.engine, 'connect', set_sqlite_pragmas)
+        event.listen(db.engine, 'before_cursor_execute', count_query)
+        event.listen(db.engine, 'after_cursor_execute', time_query)
+        migrations.upgrade(db.engine, db.metadata)
+        search.fill_index(db.session)
+        # forked workers must not share the connections opened here, they open their own on their first request;
+        # an in-memory database only lives as long as its one connection
+        if not in_memory_database(app.config['SQLALCHEMY_DATABASE_URI']):
+            db.engine.dispose()
+    return app
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    create_app().run(debug=True)
 
 
@@ -0,0 +1,131 @@
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+
+try:
+    from PIL import Image, features
+except ImportError:
+    Image = None
+
+
+# Uploaded images are stored under the sha256 of their content (media/<first two hex digits>/<hash>.<extension>), so
+# the same picture uploaded twice is kept once and a stored file never changes. The web worker only hashes and writes
+# the bytes; decoding and resizing happen in a process pool and the thumbnails appear next to the original.
+IMAGE_SIGNATURES = [(b'\xff\xd8\xff', 'jpg'), (b'\x89PNG\r\n\x1a\n', 'png'), (b'GIF87a', 'gif'), (b'GIF89a', 'gif')]
+IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'gif', 'webp']
+THUMBNAIL_SIZES = [160, 480]
+THUMBNAIL_EXTENSION = 'webp' if Image and features.check('webp') else 'jpg'
+MEDIA_NAME = re.compile(r'^([0-9a-f]{64})(?:-(\d+))?\.(jpg|png|gif|webp)$')
+CHUNK_SIZE = 64 * 1024
+
+executor = None
+pending = {}
+pending_lock = threading.Lock()
+
+
+def image_type(header):
+    """Extension of the image format, judged from the first bytes only, or None if it isn't an image we take."""
+    for signature, extension in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return extension
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def media_path(directory, name):
+    return os.path.join(directory, name[:2], name)
+
+
+def thumbnail_name(name, size):
+    return f"{name.rsplit('.', 1)[0]}-{size}.{THUMBNAIL_EXTENSION}"
+
+
+def save_upload(directory, stream, workers=2):
+    """Store an uploaded image and queue its thumbnails; returns the name to keep in an img column."""
+    extension = image_type(stream.read(16))
+    if extension is None:
+        raise ValueError("Not a jpeg, png, gif or webp image")
+    stream.seek(0)
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha256()
+    descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as temporary_file:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                temporary_file.write(chunk)
+        name = f"{digest.hexdigest()}.{extension}"
+        path = media_path(directory, name)
+        if os.path.exists(path):
+            os.remove(temporary_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+    queue_thumbnails(directory, name, workers)
+    return name
+
+
+def queue_thumbnails(directory, name, workers=2):
+    global executor
+    if Image is None:
+        return
+    path = media_path(directory, name)
+    if all(os.path.exists(media_path(directory, thumbnail_name(name, size))) for size in THUMBNAIL_SIZES):
+        return
+    with pending_lock:
+        if name in pending:
+            return
+        if executor is None:
+            # spawned workers don't inherit the web worker's threads, locks or database connections
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        future = executor.submit(make_thumbnails, path, THUMBNAIL_SIZES, THUMBNAIL_EXTENSION)
+        pending[name] = future
+    future.add_done_callback(lambda done: forget(name))
+
+
+def forget(name):
+    with pending_lock:
+        pending.pop(name, None)
+
+
+def make_thumbnails(path, sizes, extension):
+    # runs in the pool
+    pillow_format = 'WEBP' if extension == 'webp' else 'JPEG'
+    with Image.open(path) as image:
+        # jpeg can be decoded at a fraction of its size right away, which is most of the work for big photos
+        image.draft('RGB', (max(sizes), max(sizes)))
+        image = image.convert('RGBA' if pillow_format == 'WEBP' and image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        for size in sizes:
+            thumbnail = image.copy()
+            thumbnail.thumbnail((size, size), Image.LANCZOS)
+            stem = path.rsplit('.', 1)[0]
+            target = f"{stem}-{size}.{extension}"
+            descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(descriptor, 'wb') as thumbnail_file:
+                thumbnail.save(thumbnail_file, pillow_format, quality=80)
+            os.replace(temporary_path, target)
+
+
+def original_name(directory, name):
+    """Name of the stored original a (maybe not yet made) thumbnail belongs to."""
+    match = MEDIA_NAME.match(name)
+    if not match:
+        return None
+    try:
+        entries = list(os.scandir(os.path.join(directory, name[:2])))
+    except OSError:
+        return None
+    for entry in entries:
+        entry_match = MEDIA_NAME.match(entry.name)
+        if entry_match and entry_match.group(1) == match.group(1) and not entry_match.group(2):
+            return entry.name
+    return None
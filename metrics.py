@@ -0,0 +1,193 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+import glob
+import json
+import os
+import secrets
+import tempfile
+import threading
+import time
+
+
+# Request metrics in the Prometheus text format. Observing is a bisect and a few additions under a lock, cheap enough
+# to stay on in production. Every process counts on its own; with a folder configured (gunicorn.conf.py does that) a
+# process writes its numbers to a file there at most once per FLUSH_SECONDS, and /metrics adds up the files of every
+# worker, those of workers which have exited included, so whichever worker answers the scrape the totals are the same
+# and only ever grow.
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+COUNT_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500]
+FLUSH_SECONDS = 1.0
+
+
+class Histogram:
+    def __init__(self, name, documentation, labels, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                # per bucket counts (the last one is +Inf), sum
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def snapshot(self):
+        with self.lock:
+            return [[list(label_values), list(counts), total] for label_values, (counts, total) in self.series.items()]
+
+    def merged(self, snapshots):
+        result = Histogram(self.name, self.documentation, self.labels, self.buckets)
+        for snapshot in snapshots:
+            for label_values, counts, total in snapshot:
+                series = result.series.setdefault(tuple(label_values), [[0] * (len(self.buckets) + 1), 0.0])
+                series[0] = [mine + theirs for mine, theirs in zip(series[0], counts)]
+                series[1] += total
+        return result
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = [(label_values, list(counts), total) for label_values, (counts, total) in self.series.items()]
+        for label_values, counts, total in sorted(series):
+            labels = format_labels(self.labels, label_values)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ['+Inf'], counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{{{labels}{',' if labels else ''}le=\"{bound}\"}} {cumulative}")
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, documentation, labels):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return [[list(label_values), value] for label_values, value in self.values.items()]
+
+    def merged(self, snapshots):
+        result = Counter(self.name, self.documentation, self.labels)
+        for snapshot in snapshots:
+            for label_values, value in snapshot:
+                result.values[tuple(label_values)] = result.values.get(tuple(label_values), 0) + value
+        return result
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            values = sorted(self.values.items())
+        for label_values, value in values:
+            lines.append(f"{self.name}{{{format_labels(self.labels, label_values)}}} {value}")
+        return lines
+
+
+def format_labels(names, values):
+    return ','.join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUESTS = Counter('deutsch_requests_total', "Finished requests.", ['endpoint', 'method', 'status'])
+REQUEST_SECONDS = Histogram('deutsch_request_duration_seconds', "Time spent handling a request.", ['endpoint'])
+QUERIES = Histogram('deutsch_request_queries', "SQL statements issued by a request.", ['endpoint'],
+                    buckets=COUNT_BUCKETS)
+QUERY_SECONDS = Histogram('deutsch_request_query_seconds', "Time a request spent in SQL statements.",
+                          ['endpoint'])
+TEMPLATE_SECONDS = Histogram('deutsch_template_render_seconds', "Time spent rendering a template.", ['template'])
+SECTION_SECONDS = Histogram('deutsch_section_seconds', "Time spent in instrumented code paths.", ['section'])
+METRICS = [REQUESTS, REQUEST_SECONDS, QUERIES, QUERY_SECONDS, TEMPLATE_SECONDS, SECTION_SECONDS]
+
+
+@contextmanager
+def timed(section):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        SECTION_SECONDS.observe(time.perf_counter() - started, section)
+
+
+class Store:
+    """The folder shared by the worker processes, one file per process."""
+
+    def __init__(self):
+        self.folder = None
+        self.pid = None
+        self.path = None
+        self.flushed_at = 0.0
+        self.lock = threading.Lock()
+
+    def configure(self, folder):
+        self.folder = folder
+
+    def process_path(self):
+        # a forked worker gets a file of its own; the token keeps a reused pid from overwriting a dead worker's file
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.path = os.path.join(self.folder, f'{self.pid}-{secrets.token_hex(4)}.json')
+        return self.path
+
+    def flush(self, force=False):
+        if not self.folder or not force and time.monotonic() - self.flushed_at < FLUSH_SECONDS:
+            return
+        with self.lock:
+            self.flushed_at = time.monotonic()
+            path = self.process_path()
+            # made here, gunicorn empties the folder after the preloaded app configured it
+            os.makedirs(self.folder, exist_ok=True)
+            descriptor, temporary_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+            with os.fdopen(descriptor, 'w') as snapshot_file:
+                json.dump({metric.name: metric.snapshot() for metric in METRICS}, snapshot_file)
+            os.replace(temporary_path, path)
+
+    def load(self):
+        snapshots = []
+        for path in glob.glob(os.path.join(self.folder, '*.json')):
+            try:
+                with open(path) as snapshot_file:
+                    snapshots.append(json.load(snapshot_file))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+
+store = Store()
+
+
+def configure(folder):
+    store.configure(folder)
+
+
+def flush():
+    """Called after every request, writes this process's numbers if the last write is FLUSH_SECONDS old."""
+    store.flush()
+
+
+def render():
+    metrics = METRICS
+    if store.folder:
+        store.flush(force=True)
+        snapshots = store.load()
+        metrics = [metric.merged(snapshot.get(metric.name, []) for snapshot in snapshots) for metric in METRICS]
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,112 @@
+from sqlalchemy import MetaData, inspect
+from sqlalchemy.schema import CreateIndex, CreateTable
+from learning import MASTERED_BOX
+import fuzzy
+import search
+
+
+# Schema changes of an existing database, applied in order on start up. PRAGMA user_version holds the number of
+# migrations already applied; a new database is created from the models, gets the UNMODELLED migrations and is
+# marked as up to date.
+LOOKUP_INDEXES = [('course_table', 'code'), ('course_table', 'name'), ('course_table', 'belong_to_user_id'),
+                  ('section_table', 'name'), ('section_table', 'belong_to_course_id'),
+                  ('word_table', 'belong_to_section_id')]
+
+
+def add_lookup_indexes(connection, metadata, dialect):
+    for table, column in LOOKUP_INDEXES:
+        connection.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_{column} ON {table} ({column})")
+
+
+def add_study_course_id(connection, metadata, dialect):
+    connection.execute("ALTER TABLE user_table ADD COLUMN study_course_id INTEGER REFERENCES course_table (id)")
+    connection.execute("UPDATE user_table SET study_course_id = (SELECT id FROM course_table "
+                       "WHERE course_table.name = user_table.study_course) WHERE study_course IS NOT NULL")
+    connection.execute("ALTER TABLE user_table DROP COLUMN study_course")
+    connection.execute("CREATE INDEX IF NOT EXISTS ix_user_table_study_course_id ON user_table (study_course_id)")
+
+
+def add_delete_cascades(connection, metadata, dialect):
+    for name in ['section_table', 'word_table', 'review_table']:
+        rebuild_table(connection, metadata, dialect, name)
+
+
+def rebuild_table(connection, metadata, dialect, name):
+    # sqlite can't alter constraints, so the table is copied into one created from the model and renamed
+    scratch = MetaData()
+    for table in metadata.tables.values():
+        table.to_metadata(scratch)
+    table = scratch.tables[name]
+    rebuilt = table.to_metadata(scratch, name=name + '_rebuilt')
+    old_columns = {row[1] for row in connection.execute(f"PRAGMA table_info({name})")}
+    columns = ', '.join(column.name for column in table.columns if column.name in old_columns)
+    connection.execute(str(CreateTable(rebuilt).compile(dialect=dialect)))
+    connection.execute(f"INSERT INTO {rebuilt.name} ({columns}) SELECT {columns} FROM {name}")
+    connection.execute(f"DROP TABLE {name}")
+    connection.execute(f"ALTER TABLE {rebuilt.name} RENAME TO {name}")
+    for index in table.indexes:
+        connection.execute(str(CreateIndex(index, if_not_exists=True).compile(dialect=dialect)))
+
+
+def add_progress_summaries(connection, metadata, dialect):
+    # the tables come from create_all(); what was learned before there were events is known from the review states
+    connection.execute(f"INSERT OR IGNORE INTO section_progress_table (user_id, section_id, seen, mastered, learned, "
+                       f"missed, reviewed_at) SELECT user_id, section_id, count(*), sum(box >= {MASTERED_BOX}), 0, 0, "
+                       f"max(reviewed_at) FROM review_table WHERE section_id IS NOT NULL GROUP BY user_id, section_id")
+
+
+def set_null_study_course(connection, metadata, dialect):
+    # deleting a course leaves its learners without one instead of failing on the foreign key
+    rebuild_table(connection, metadata, dialect, 'user_table')
+
+
+def add_search_index(connection, metadata, dialect):
+    # filled by search.fill_index() on start up; IF NOT EXISTS as the table used to be created there
+    connection.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {search.SEARCH_TABLE} USING fts5(name, meaning, "
+                       f"description, section_id UNINDEXED, tokenize = 'trigram')")
+
+
+def add_fuzzy_index(connection, metadata, dialect):
+    connection.execute(f"CREATE TABLE IF NOT EXISTS {fuzzy.TERM_TABLE} (id INTEGER PRIMARY KEY, "
+                       f"term TEXT NOT NULL UNIQUE, display TEXT NOT NULL, size INTEGER NOT NULL, "
+                       f"refs INTEGER NOT NULL)")
+    connection.execute(f"CREATE TABLE IF NOT EXISTS {fuzzy.VARIANT_TABLE} (variant TEXT NOT NULL, "
+                       f"size INTEGER NOT NULL, term_id INTEGER NOT NULL, PRIMARY KEY (variant, size, term_id)) "
+                       f"WITHOUT ROWID")
+
+
+MIGRATIONS = [add_lookup_indexes, add_study_course_id, add_delete_cascades, add_progress_summaries,
+              set_null_study_course, add_search_index, add_fuzzy_index]
+# schema the models can't describe, a new database gets it from these migrations as well
+UNMODELLED = [add_search_index, add_fuzzy_index]
+
+
+def upgrade(engine, metadata):
+    fresh = not inspect(engine).has_table('user_table')
+    metadata.create_all(engine)
+    pooled_connection = engine.raw_connection()
+    connection = pooled_connection.driver_connection
+    isolation_level = connection.isolation_level
+    # autocommit mode, so BEGIN/COMMIT below wrap the DDL of a migration in one transaction
+    connection.isolation_level = None
+    try:
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if fresh:
+            for migration in UNMODELLED:
+                migration(connection, metadata, engine.dialect)
+            connection.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+            return
+        connection.execute("PRAGMA foreign_keys = OFF")
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            connection.execute("BEGIN")
+            try:
+                migration(connection, metadata, engine.dialect)
+                connection.execute(f"PRAGMA user_version = {number}")
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+    finally:
+        connection.execute("PRAGMA foreign_keys = ON")
+        connection.isolation_level = isolation_level
+        pooled_connection.close()
@@ -0,0 +1,156 @@
+import re
+from sqlalchemy import text, bindparam
+import fuzzy
+
+
+# Words are stored in an FTS5 shadow table (rowid = word_table.id). The trigram tokenizer keeps the old
+# "substring" behaviour of the search bar (haus -> Krankenhaus) while every lookup goes through the index.
+SEARCH_TABLE = "word_search"
+RESULTS_PER_PAGE = 20
+# trigram MATCH needs three characters; anything shorter could only be found by scanning every row
+MIN_TERM_LENGTH = 3
+FOLD_TABLE = str.maketrans({'ä': 'ae', 'ö': 'oe', 'ü': 'ue', 'ß': 'ss'})
+TAG_PATTERN = re.compile(r'<[^>]+>')
+TERM_PATTERN = re.compile(r'\w+')
+
+
+def fold(value):
+    if not value:
+        return ''
+    return TAG_PATTERN.sub(' ', value).lower().translate(FOLD_TABLE)
+
+
+def search_terms(query):
+    return TERM_PATTERN.findall(fold(query))
+
+
+def searchable_terms(query):
+    """The terms of a query the index can look up; shorter ones are left out."""
+    return [term for term in search_terms(query) if len(term) >= MIN_TERM_LENGTH]
+
+
+def fill_index(session):
+    """Index every word if the tables (created by the migrations) are still empty."""
+    if not session.execute(text("SELECT 1 FROM word_table LIMIT 1")).first():
+        return
+    if not session.execute(text(f"SELECT 1 FROM {SEARCH_TABLE} LIMIT 1")).first():
+        rebuild_index(session)
+        session.commit()
+    elif not session.execute(text(f"SELECT 1 FROM {fuzzy.TERM_TABLE} LIMIT 1")).first():
+        rebuild_fuzzy_index(session)
+        session.commit()
+
+
+def rebuild_index(session):
+    session.execute(text(f"DELETE FROM {SEARCH_TABLE}"))
+    fuzzy.clear_index(session)
+    index_rows(session, session.execute(text("SELECT id, name, meaning, description, belong_to_section_id "
+                                             "FROM word_table")))
+
+
+def rebuild_fuzzy_index(session):
+    fuzzy.clear_index(session)
+    batch = []
+    for row in session.execute(text("SELECT name, meaning FROM word_table")):
+        batch.extend((fold(value), value) for value in row)
+        if len(batch) >= 10000:
+            fuzzy.add_terms(session, batch)
+            batch = []
+    fuzzy.add_terms(session, batch)
+
+
+def index_section(session, section_id):
+    index_rows(session, session.execute(text("SELECT id, name, meaning, description, belong_to_section_id "
+                                             "FROM word_table WHERE belong_to_section_id = :section_id"),
+                                        {'section_id': section_id}))
+
+
+def index_rows(session, rows):
+    batch = []
+    for row in rows:
+        batch.append(index_row(*row))
+        if len(batch) == 1000:
+            insert_rows(session, batch)
+            batch = []
+    if batch:
+        insert_rows(session, batch)
+
+
+def index_row(word_id, name, meaning, description, section_id):
+    # name_text and meaning_text are only there for the fuzzy index, which suggests them as they were written
+    return {'id': word_id, 'name': fold(name), 'meaning': fold(meaning), 'description': fold(description),
+            'section_id': int(section_id) if section_id else None, 'name_text': name, 'meaning_text': meaning}
+
+
+def insert_rows(session, rows):
+    session.execute(text(f"INSERT INTO {SEARCH_TABLE} (rowid, name, meaning, description, section_id) "
+                         f"VALUES (:id, :name, :meaning, :description, :section_id)"), rows)
+    fuzzy.add_terms(session, [(row['name'], row['name_text']) for row in rows] +
+                    [(row['meaning'], row['meaning_text']) for row in rows])
+
+
+def index_word(session, word):
+    unindex_words(session, [word.id])
+    insert_rows(session, [index_row(word.id, word.name, word.meaning, word.description,
+                                    word.belong_to_section_id)])
+
+
+def unindex_words(session, word_ids):
+    removed = session.execute(text(f"SELECT name, meaning FROM {SEARCH_TABLE} WHERE rowid IN :word_ids")
+                              .bindparams(bindparam('word_ids', expanding=True)), {'word_ids': list(word_ids)})
+    fuzzy.remove_terms(session, [value for row in removed for value in row])
+    session.execute(text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN :word_ids")
+                    .bindparams(bindparam('word_ids', expanding=True)), {'word_ids': list(word_ids)})
+
+
+def reindex_words(session, word_ids):
+    unindex_words(session, word_ids)
+    index_rows(session, session.execute(text("SELECT id, name, meaning, description, belong_to_section_id "
+                                             "FROM word_table WHERE id IN :word_ids")
+                                        .bindparams(bindparam('word_ids', expanding=True)),
+                                        {'word_ids': list(word_ids)}))
+
+
+def unindex_sections(session, section_ids):
+    removed = session.execute(text(f"SELECT name, meaning FROM {SEARCH_TABLE} WHERE rowid IN "
+                                   f"(SELECT id FROM word_table WHERE belong_to_section_id IN :section_ids)")
+                              .bindparams(bindparam('section_ids', expanding=True)),
+                              {'section_ids': list(section_ids)})
+    fuzzy.remove_terms(session, [value for row in removed for value in row])
+    session.execute(text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN "
+                         f"(SELECT id FROM word_table WHERE belong_to_section_id IN :section_ids)")
+                    .bindparams(bindparam('section_ids', expanding=True)), {'section_ids': list(section_ids)})
+
+
+def search_words(session, query, section_id=None, course_id=None, page=1, per_page=RESULTS_PER_PAGE):
+    """Return (word ids of the requested page, total number of matches), best matches first."""
+    terms = searchable_terms(query)
+    if not terms:
+        return [], 0
+    where = f"{SEARCH_TABLE} MATCH :match"
+    params = {'match': ' AND '.join('"' + term + '"' for term in terms)}
+    order = f"bm25({SEARCH_TABLE}, 10.0, 5.0, 1.0, 0.0)"
+    if section_id:
+        where += " AND section_id = :section_id"
+        params['section_id'] = section_id
+    if course_id:
+        where += " AND section_id IN (SELECT id FROM section_table WHERE belong_to_course_id = :course_id)"
+        params['course_id'] = course_id
+    total = session.execute(text(f"SELECT count(*) FROM {SEARCH_TABLE} WHERE {where}"), params).scalar()
+    params['limit'] = per_page
+    params['offset'] = (max(page, 1) - 1) * per_page
+    rows = session.execute(text(f"SELECT rowid FROM {SEARCH_TABLE} WHERE {where} ORDER BY {order} "
+                                f"LIMIT :limit OFFSET :offset"), params)
+    return [row[0] for row in rows], total
+
+
+def suggest_words(session, query, limit=5):
+    """Known word names and meanings close to a query which may be misspelled ("did you mean"), without the query
+    itself."""
+    query = fuzzy.without_article(fold(query))
+    return [suggestion for suggestion in fuzzy.suggest(session, query, limit=limit + 1)
+            if fuzzy.without_article(fold(suggestion)) != query][:limit]
+
+
+def grade_answer(answer, name, gender=None):
+    return fuzzy.grade(fold(answer), fold(name), gender)
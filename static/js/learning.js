@@ -0,0 +1,146 @@
+(function($) {
+  "use strict"; // Start of use strict
+
+  // The whole deck of the section is loaded once, "Show Answer", "Next" and "I Got it" then run in the browser
+  // and the learned words are sent back to the server in batches.
+  var $card = $("#learning-card");
+  var deckUrl = $card.data("deckUrl");
+  var progressUrl = $card.data("progressUrl");
+  var answerUrl = $card.data("answerUrl");
+  if (!deckUrl) {
+    return;
+  }
+  var BATCH_SIZE = 10;
+  var GENDER_COLORS = {die: "red", der: "blue", das: "green"};
+  var deck = [];
+  var position = -1;
+  var learned = [];
+  var missed = [];
+  var revealed = false;
+
+  function paragraph(text, color) {
+    return $("<p class='card-text'></p>").text(text || "").css("color", color || "");
+  }
+
+  function render() {
+    var $answer = $("#word-answer").empty();
+    if (position < 0) {
+      $("#word-name").text($card.data("finished")).css("color", "green");
+      $("#card-links").hide();
+      $("#answer-form").hide();
+      $("#word-image").hide();
+      return;
+    }
+    var word = deck[position];
+    $("#word-name").text(word[1]).css("color", "");
+    $("#word-image").attr("src", word[5] || "").toggle(!!word[5]);
+    if (revealed) {
+      var color = GENDER_COLORS[word[3]];
+      if (color) {
+        $answer.append(paragraph(word[3] + " " + word[2], color), paragraph("", color), paragraph(word[4], color));
+      } else {
+        $answer.append(paragraph(word[3]), paragraph(word[2]), paragraph(word[4]));
+      }
+    }
+  }
+
+  function draw() {
+    position = deck.length ? Math.floor(Math.random() * deck.length) : -1;
+    revealed = false;
+    render();
+  }
+
+  function learn() {
+    learned.push(deck[position][0]);
+    deck[position] = deck[deck.length - 1];
+    deck.pop();
+    if (learned.length + missed.length >= BATCH_SIZE || !deck.length) {
+      flush(false);
+    }
+    draw();
+  }
+
+  function feedback(message) {
+    $("#answer-feedback").empty().append(paragraph(message));
+  }
+
+  function flush(leavingPage) {
+    if (!learned.length && !missed.length) {
+      return;
+    }
+    var body = JSON.stringify({learned: learned, missed: missed});
+    learned = [];
+    missed = [];
+    if (leavingPage && navigator.sendBeacon) {
+      navigator.sendBeacon(progressUrl, new Blob([body], {type: "application/json"}));
+    } else {
+      $.ajax({url: progressUrl, type: "POST", contentType: "application/json", data: body});
+    }
+  }
+
+  $.getJSON(deckUrl, function(data) {
+    // only the words which are due for this learner are studied
+    var due = {};
+    $.each($card.data("dueIds"), function(i, wordId) {
+      due[wordId] = true;
+    });
+    deck = $.grep(data.words, function(word) {
+      return due[word[0]];
+    });
+    var currentId = $card.data("wordId");
+    for (var i = 0; i < deck.length; i++) {
+      if (deck[i][0] === currentId) {
+        position = i;
+      }
+    }
+    $("#show-answer").on("click", function(e) {
+      e.preventDefault();
+      revealed = true;
+      render();
+    });
+    $("#next-word").on("click", function(e) {
+      e.preventDefault();
+      feedback("");
+      if (revealed) {
+        missed.push(deck[position][0]);
+      }
+      if (learned.length + missed.length >= BATCH_SIZE) {
+        flush(false);
+      }
+      draw();
+    });
+    $("#got-it").on("click", function(e) {
+      e.preventDefault();
+      feedback("");
+      learn();
+    });
+    // typed answers are graded by the server (typos and articles), a right one counts like "I Got it"
+    $("#answer-form").on("submit", function(e) {
+      e.preventDefault();
+      var $input = $(this).find("input[name=answer]");
+      if (position < 0 || !$.trim($input.val())) {
+        return;
+      }
+      var wordId = deck[position][0];
+      $.ajax({url: answerUrl, type: "POST", contentType: "application/json", dataType: "json",
+              data: JSON.stringify({word_id: wordId, answer: $input.val()})}).done(function(result) {
+        if (position < 0 || deck[position][0] !== wordId) {
+          return;
+        }
+        feedback(result.message);
+        $input.val("");
+        if (result.correct) {
+          learn();
+        } else {
+          revealed = true;
+          render();
+        }
+      });
+    });
+  });
+
+  $(window).on("pagehide", function() {
+    flush(true);
+  });
+
+})(jQuery); // End of use strict
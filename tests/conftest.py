@@ -0,0 +1,43 @@
+import pytest
+from werkzeug.security import generate_password_hash
+import main
+
+PASSWORD = 'secret'
+
+
+@pytest.fixture
+def app():
+    # an in-memory database per test; jobs are not run in the background
+    app = main.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'SECRET_KEY': 'test', 'TESTING': True,
+                           'WTF_CSRF_ENABLED': False, 'JOB_WORKERS': 0, 'LEARNING_SESSION_STORE': 'memory',
+                           'PAGE_CACHE': 'memory'})
+    main.identity_cache.identities.clear()
+    with app.app_context():
+        yield app
+    main.identity_cache.identities.clear()
+
+
+@pytest.fixture
+def add(app):
+    """add(Model, **columns) inserts a row and returns it."""
+    def add_row(model, **columns):
+        if model is main.User:
+            columns = {'name': columns['email'], 'password': generate_password_hash(PASSWORD),
+                       'date_of_register': '2026-01-01', **columns}
+        row = model(**columns)
+        main.db.session.add(row)
+        main.db.session.commit()
+        return row
+
+    return add_row
+
+
+@pytest.fixture
+def login(app):
+    """login(user) returns a test client logged in as that user."""
+    def logged_in_client(user):
+        client = app.test_client()
+        client.post('/login', data={'email': user.email, 'password': PASSWORD})
+        return client
+
+    return logged_in_client
@@ -0,0 +1,21 @@
+import main
+
+
+def test_word_moved_to_another_course_takes_its_progress(add, login):
+    admin = add(main.User, email='admin@example.com')
+    first_manager = add(main.User, email='first@example.com')
+    second_manager = add(main.User, email='second@example.com')
+    first_course = add(main.Course, name='Deutsch - A1', belong_to_user_id=first_manager.id)
+    second_course = add(main.Course, name='Deutsch - A2', belong_to_user_id=second_manager.id)
+    first_section = add(main.Section, name='Haus', belong_to_course_id=first_course.id)
+    second_section = add(main.Section, name='Stadt', belong_to_course_id=second_course.id)
+    word = add(main.Word, name='Haus', meaning='house', belong_to_section_id=first_section.id)
+    add(main.WordProgress, course_id=first_course.id, word_id=word.id, learned=0, missed=3, difficulty=0.9)
+
+    response = login(admin).patch('/api/words', json={'id': word.id, 'section_id': second_section.id})
+    assert response.status_code == 200
+
+    first_hardest = main.course_progress([first_section], [first_course.id])[1]
+    second_hardest = main.course_progress([second_section], [second_course.id])[1]
+    assert first_hardest == []
+    assert [hardest_word.id for hardest_word, progress in second_hardest] == [word.id]
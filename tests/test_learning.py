@@ -0,0 +1,18 @@
+import main
+
+
+def test_deck_answer_rejects_malformed_bodies(add, login):
+    add(main.User, email='admin@example.com')
+    learner = add(main.User, email='learner@example.com')
+    course = add(main.Course, name='Deutsch - A1', language='Deutsch', level='A1')
+    section = add(main.Section, name='Haus', belong_to_course_id=course.id)
+    word = add(main.Word, name='Haus', meaning='house', gender='das', belong_to_section_id=section.id)
+    client = login(learner)
+    url = f'/deck/{section.id}/answer'
+    assert client.post(url, json=[1]).status_code == 400
+    assert client.post(url, json={'word_id': [1], 'answer': 'x'}).status_code == 400
+    assert client.post(url, json={'word_id': True, 'answer': 'x'}).status_code == 400
+    assert client.post(url, json={'word_id': word.id, 'answer': 5}).status_code == 400
+    response = client.post(url, json={'word_id': word.id, 'answer': 'das Haus'})
+    assert response.status_code == 200
+    assert response.get_json()['grade'] == 'correct'
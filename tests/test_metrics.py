@@ -0,0 +1,20 @@
+import os
+import shutil
+import metrics
+
+
+def requests_total(text, endpoint):
+    prefix = f'deutsch_requests_total{{endpoint="{endpoint}",method="GET",status="200"}} '
+    return sum(int(line[len(prefix):]) for line in text.splitlines() if line.startswith(prefix))
+
+
+def test_render_adds_up_the_worker_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'store', metrics.Store())
+    metrics.configure(str(tmp_path))
+    metrics.REQUESTS.inc('test_endpoint', 'GET', 200, amount=3)
+    metrics.store.flush(force=True)
+    # another worker, which counted the same, left its file behind
+    own_file, = os.listdir(tmp_path)
+    shutil.copy(tmp_path / own_file, tmp_path / 'another-worker.json')
+    assert requests_total(metrics.render(), 'test_endpoint') == 2 * requests_total(
+        '\n'.join(metrics.REQUESTS.render()), 'test_endpoint')
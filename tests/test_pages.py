@@ -0,0 +1,20 @@
+from datetime import datetime, timedelta
+import main
+
+
+def test_cached_page_answers_if_modified_since(add, login):
+    admin = add(main.User, email='admin@example.com')
+    add(main.Course, name='Deutsch - A1')
+    main.bump_versions('courses')
+    main.db.session.commit()
+    client = login(admin)
+    response = client.get('/admin')
+    assert response.status_code == 200
+    last_modified = response.headers['Last-Modified']
+
+    assert client.get('/admin', headers={'If-Modified-Since': last_modified}).status_code == 304
+
+    main.Counter.query.filter_by(name='version:courses').update(
+        {main.Counter.updated_at: datetime.utcnow() + timedelta(seconds=5)})
+    main.db.session.commit()
+    assert client.get('/admin', headers={'If-Modified-Since': last_modified}).status_code == 200
@@ -0,0 +1,16 @@
+import main
+import search
+
+
+def test_search_needs_terms_of_three_letters(add, login):
+    learner = add(main.User, email='learner@example.com')
+    course = add(main.Course, name='Deutsch - A1')
+    section = add(main.Section, name='Stadt', belong_to_course_id=course.id)
+    word = add(main.Word, name='Krankenhaus', meaning='hospital', belong_to_section_id=section.id)
+    search.index_word(main.db.session, word)
+    main.db.session.commit()
+    assert search.search_words(main.db.session, 'haus') == ([word.id], 1)
+    assert search.search_words(main.db.session, 'ha') == ([], 0)
+    assert search.search_words(main.db.session, 'ha haus') == ([word.id], 1)
+    page = login(learner).get('/search?q=ha').get_data(as_text=True)
+    assert 'at least 3 letters' in page
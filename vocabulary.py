@@ -0,0 +1,93 @@
+import csv
+import io
+import json
+import zlib
+
+
+# Same rules as WordForm: name and meaning are required and the gender is one of the SelectField choices.
+GENDERS = ['', 'der', 'die', 'das']
+IMPORT_BATCH_SIZE = 500
+MAX_REPORTED_ERRORS = 200
+
+
+def parse_word_rows(stream, filename):
+    """Yield (line number, word, error) for every row of an uploaded csv, tsv or Anki text export.
+
+    The file is read row by row from the upload stream, so nothing but the current row is kept in memory.
+    Columns are name, meaning, gender, description; lines starting with '#' (Anki headers) are skipped.
+    """
+    delimiter = ',' if filename.lower().endswith('.csv') else '\t'
+    reader = csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''), delimiter=delimiter)
+    for row in reader:
+        if not any(cell.strip() for cell in row) or row[0].startswith('#'):
+            continue
+        if reader.line_num == 1 and row[0].strip().lower() in ('name', 'word'):
+            continue
+        name, meaning, gender, description = ([cell.strip() for cell in row] + ['', '', '', ''])[:4]
+        article = name.split(' ', 1)
+        if not gender and len(article) == 2 and article[0].lower() in GENDERS:
+            gender, name = article[0], article[1].strip()
+        word = {'name': name, 'meaning': meaning, 'gender': gender.lower(), 'description': description}
+        yield reader.line_num, word, validate_word(word)
+
+
+def validate_word(word, partial=False):
+    # with partial=True only the given fields are checked (updates of some fields of a word)
+    if (not partial or 'name' in word) and not word.get('name'):
+        return "Word is missing"
+    if (not partial or 'meaning' in word) and not word.get('meaning'):
+        return "Meaning is missing"
+    if (word.get('gender') or '') not in GENDERS:
+        return f"Gender must be der, die or das, not '{word['gender']}'"
+    if len(word.get('name') or '') > 150 or len(word.get('meaning') or '') > 200 or \
+            len(word.get('description') or '') > 500:
+        return "Text is too long"
+    return None
+
+
+EXPORT_COLUMNS = ['section', 'word', 'meaning', 'gender', 'description']
+EXPORT_FORMATS = {'csv': ('text/csv', 'csv'), 'jsonl': ('application/x-ndjson', 'jsonl'), 'anki': ('text/plain', 'txt')}
+EXPORT_CHUNK_SIZE = 64 * 1024
+ANKI_HEADER = "#separator:tab\n#html:true\n#columns:Front\tBack\tTags\n#tags column:3\n"
+
+
+def export_chunks(rows, export_format):
+    """Turn (section, word, meaning, gender, description) rows into text chunks of about EXPORT_CHUNK_SIZE.
+
+    Rows are consumed one by one, so an export never holds more than one chunk in memory.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if export_format == 'csv':
+        writer.writerow(EXPORT_COLUMNS)
+    elif export_format == 'anki':
+        buffer.write(ANKI_HEADER)
+    for row in rows:
+        if export_format == 'csv':
+            writer.writerow(row)
+        elif export_format == 'jsonl':
+            buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + '\n')
+        else:
+            section, name, meaning, gender, description = row
+            front = f"{gender} {name}" if gender else name
+            back = f"{meaning}<br>{description}" if description else meaning
+            tag = '_'.join(section.split())
+            buffer.write('\t'.join(anki_field(field) for field in (front, back, tag)) + '\n')
+        if buffer.tell() >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def anki_field(value):
+    return (value or '').replace('\t', ' ').replace('\r', '').replace('\n', '<br>')
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,4 @@
+"""The application for WSGI servers: gunicorn -c gunicorn.conf.py wsgi:app (see README.md)."""
+from main import create_app
+
+app = create_app()